@@ -4,7 +4,9 @@ import requests
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
 
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob import ContentSettings
+
+from blob_clients import ensure_container, get_blob_client, get_container_client
 
 
 # -------------------------
@@ -27,8 +29,7 @@ def _download_via_azure(url: str) -> bytes:
 
     container, blob_path = path.split("/", 1)
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    blob_client = bsc.get_container_client(container).get_blob_client(blob_path)
+    blob_client = get_blob_client(container, blob_path)
     return blob_client.download_blob().readall()
 
 
@@ -118,13 +119,8 @@ def _upload_pdf(filename: str, pdf_bytes: bytes) -> str:
 
     container_name = "quotes-output"
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    container_client = bsc.get_container_client(container_name)
-
-    try:
-        container_client.create_container()
-    except Exception:
-        pass
+    ensure_container(container_name)
+    container_client = get_container_client(container_name)
 
     blob_client = container_client.get_blob_client(filename)
     blob_client.upload_blob(
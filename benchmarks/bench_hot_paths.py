@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks for the hot paths, checked against stored baselines.
+
+    python benchmarks/bench_hot_paths.py                     # compare with baselines.json
+    python benchmarks/bench_hot_paths.py -k fill_pdf_form    # only matching cases
+    python benchmarks/bench_hot_paths.py --update-baseline   # record this machine's numbers
+
+Each case reports its best per-call time over --repeat runs. A case fails
+when it is more than --threshold slower than its baseline. Baselines are
+machine specific, so record them on the machine (or CI runner class) that
+runs the check.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+from synthetic import make_field_map, make_json, make_template, make_workbook, token_names
+
+import fitz  # PyMuPDF
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+TEMPLATE_SIZES = ((1, 10), (5, 50), (20, 200))
+JSON_SIZES = ((4, 2), (6, 3), (8, 4))
+WORKBOOK_ROWS = (50, 500)
+
+
+def _json_cases():
+    from quote_generator import ABC_FIELD_PATHS, flatten_json
+
+    for width, depth in JSON_SIZES:
+        doc = make_json(width, depth)
+        yield f"flatten_json[w{width}d{depth}]", lambda doc=doc: flatten_json(doc)
+        yield f"flatten_json[w{width}d{depth},paths]", lambda doc=doc: flatten_json(doc, paths=ABC_FIELD_PATHS)
+
+
+def _field_map_cases():
+    from field_mapping import _normalize_lookup_str, normalize_lookup_key
+    from quote_generator import ABC_FIELD_PATHS, GW_FIELD_PATHS, build_pdf_field_map
+
+    names = [f"SubDoc.{name}" for name in token_names(200)]
+    yield "normalize_lookup_key[cached]", lambda: [normalize_lookup_key(n) for n in names]
+    yield "normalize_lookup_key[uncached]", lambda: [_normalize_lookup_str.__wrapped__(n) for n in names]
+
+    abc = {path: f"abc {path}" for path in ABC_FIELD_PATHS}
+    gw = {path: 1234.5 for path in GW_FIELD_PATHS}
+    yield "build_pdf_field_map", lambda: build_pdf_field_map(abc, gw)
+
+
+def _pdf_cases():
+    from pdf_fill import _collect_tokens, build_template_index, fill_pdf_form
+
+    for pages, tokens in TEMPLATE_SIZES:
+        template = make_template(pages, tokens)
+        with fitz.open(stream=template, filetype="pdf") as doc:
+            texts = [page.get_text("text") for page in doc]
+        index = build_template_index(template)
+        field_map = make_field_map(tokens)
+
+        size = f"p{pages}t{tokens}"
+        yield f"_collect_tokens[{size}]", lambda texts=texts: [_collect_tokens(t) for t in texts]
+        yield f"build_template_index[{size}]", lambda t=template: build_template_index(t)
+        yield f"fill_pdf_form[{size}]", lambda t=template, m=field_map, i=index: fill_pdf_form(t, m, i)
+        yield f"fill_pdf_form[{size},no-index]", lambda t=template, m=field_map: fill_pdf_form(t, m)
+
+
+def _excel_cases():
+    try:
+        import generator
+    except Exception as e:
+        for rows in WORKBOOK_ROWS:
+            yield f"generator._read_excel_to_dict_url[r{rows}]", f"generator does not import: {e!r}"
+        return
+
+    # Serve the workbook from memory; no validators, so nothing is cached between calls
+    books = {f"mem://{rows}": make_workbook(rows) for rows in WORKBOOK_ROWS}
+    generator.download_if_changed = lambda url, validators, policy=None: (books[url], {})
+    for rows in WORKBOOK_ROWS:
+        yield f"generator._read_excel_to_dict_url[r{rows}]", lambda url=f"mem://{rows}": generator._read_excel_to_dict_url(url)
+
+
+def _cases():
+    for group in (_json_cases, _field_map_cases, _pdf_cases, _excel_cases):
+        yield from group()
+
+
+def _best_us(fn, repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def _load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return {}
+
+
+def _save_baseline(results: dict) -> None:
+    baseline = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(), "fitz": fitz.VersionBind},
+        "results": {name: round(us, 2) for name, us in sorted(results.items())},
+    }
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="match", default="", help="only run cases containing this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    if "PYTHONHASHSEED" not in os.environ:
+        # The workbook cases swing by ~50% with the hash seed; pin it so runs compare
+        os.environ["PYTHONHASHSEED"] = "0"
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    baseline = _load_baseline()
+    results = {}
+    regressions = []
+
+    print(f"{'case':<48} {'baseline us':>12} {'current us':>12} {'ratio':>7}")
+    for name, fn in _cases():
+        if args.match not in name:
+            continue
+        if isinstance(fn, str):
+            print(f"{name:<48} {'skipped':>12}  {fn}")
+            continue
+
+        results[name] = us = _best_us(fn, args.repeat)
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<48} {'-':>12} {us:>12.1f} {'new':>7}")
+            continue
+        ratio = us / base
+        status = ""
+        if ratio > 1 + args.threshold:
+            regressions.append(name)
+            status = "  REGRESSION"
+        print(f"{name:<48} {base:>12.1f} {us:>12.1f} {ratio:>7.2f}{status}")
+
+    if args.update_baseline:
+        # Cases not run this time (-k, skipped) keep their stored numbers
+        _save_baseline({**baseline, **results})
+        print(f"baseline written to {BASELINE_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure cold import time of the quote modules with ``python -X importtime``.
+
+    python benchmarks/bench_import_time.py --runs 5 --budget-ms 150
+
+Each run is a fresh interpreter. Exits non-zero when a module's median
+import time is over budget or it pulls in a dependency that should only
+load on first use.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ("quote_generator", "blob_clients", "fetch_policy", "field_mapping", "result_cache")
+
+# Heavy dependencies that must stay out of module import
+DEFERRED = ("fitz", "pymupdf", "requests", "azure.core", "azure.storage.blob", "openpyxl", "pandas")
+
+_PROBE = "import sys, {module}; print(' '.join(m for m in {deferred!r} if m in sys.modules))"
+
+
+def _import_once(module: str) -> tuple:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (REPO_ROOT, env.get("PYTHONPATH")) if p)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, deferred=DEFERRED)],
+        capture_output=True, text=True, env=env, check=True,
+    )
+
+    # "import time: self [us] | cumulative | imported package"; a package is
+    # listed after everything it imported, nested two spaces deeper
+    children = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == module:
+                return int(cumulative) / 1000, children, proc.stdout.split()
+            children = []
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--top", type=int, default=5, help="heaviest direct imports to list")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':>16} {'median ms':>10} {'min ms':>8}  deferred deps loaded")
+    for module in MODULES:
+        samples = []
+        for _ in range(args.runs):
+            ms, children, loaded = _import_once(module)
+            samples.append(ms)
+
+        over = statistics.median(samples) > args.budget_ms
+        failed = failed or over or bool(loaded)
+        flag = "  OVER BUDGET" if over else ""
+        print(f"{module:>16} {statistics.median(samples):>10.1f} {min(samples):>8.1f}  {' '.join(loaded) or '-'}{flag}")
+        for name, us in sorted(children, key=lambda c: -c[1])[:args.top]:
+            print(f"{'':>18}{name:<30} {us / 1000:>8.1f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
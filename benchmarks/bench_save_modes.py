@@ -0,0 +1,41 @@
+"""
+Compare full save against incremental save for fill_pdf_form.
+
+    python benchmarks/bench_save_modes.py --quotes 50
+"""
+import argparse
+import time
+
+from synthetic import make_field_map, make_template
+
+from pdf_fill import build_template_index, fill_pdf_form
+
+
+def _run(template, field_map, index, quotes, incremental):
+    fill_pdf_form(template, field_map, index, incremental=incremental)  # warm-up
+    total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(quotes):
+        total_bytes += len(fill_pdf_form(template, field_map, index, incremental=incremental))
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000 / quotes, total_bytes // quotes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quotes", type=int, default=50)
+    args = parser.parse_args()
+
+    # "open+save" fills nothing, isolating the cost of the output mode itself
+    print(f"{'pages':>5} {'tokens':>6} {'mode':>12} {'work':>10} {'ms/quote':>9} {'bytes/quote':>12}")
+    for pages, tokens in ((1, 10), (5, 50), (20, 200)):
+        template = make_template(pages, tokens)
+        index = build_template_index(template)
+        for work, field_map in (("open+save", {}), ("fill+save", make_field_map(tokens))):
+            for mode, incremental in (("full", False), ("incremental", True)):
+                ms, size = _run(template, field_map, index, args.quotes, incremental)
+                print(f"{pages:>5} {tokens:>6} {mode:>12} {work:>10} {ms:>9.2f} {size:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Check that streamed JSON extraction returns what json.loads would.
+
+    python benchmarks/check_json_paths.py
+
+Each document goes through stream_json_paths (ijson when installed) and
+through json.loads + flatten_json; the extracted values and their types
+must match, including integers too large for 64 bits and floats.
+"""
+import io
+import json
+import sys
+
+from synthetic import make_json
+
+from quote_generator import flatten_json, stream_json_paths
+
+CASES = (
+    ("large int", b'{"id": 10000000000000000000000, "e": 1}'),
+    ("negative large int", b'{"id": -98765432109876543210987, "e": 2}'),
+    ("float", b'{"a": {"premium": 1200.5, "rate": 0.1, "exp": 1e3, "neg": -2.25E-2}}'),
+    ("mixed", b'{"x": [1, 2.5, {"y": 123456789012345678901234567890}], "s": "text", "n": null, "b": true}'),
+)
+
+
+def _compare(doc: bytes) -> list:
+    expected = flatten_json(json.loads(doc))
+    streamed = stream_json_paths(io.BytesIO(doc), expected)
+    return [
+        f"{key}: {streamed.get(key)!r} != {value!r}"
+        for key, value in expected.items()
+        if streamed.get(key) != value or type(streamed.get(key)) is not type(value)
+    ]
+
+
+def main():
+    cases = list(CASES) + [("synthetic", json.dumps(make_json(6, 3)).encode("utf-8"))]
+    failed = False
+    for name, doc in cases:
+        try:
+            diffs = _compare(doc)
+        except Exception as e:
+            diffs = [repr(e)]
+        failed = failed or bool(diffs)
+        print(f"{name:<20} {'ok' if not diffs else '; '.join(diffs)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
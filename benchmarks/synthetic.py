@@ -0,0 +1,81 @@
+"""Synthetic templates and payloads shared by the benchmark scripts."""
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+
+from field_mapping import normalize_lookup_key
+
+
+def token_names(count: int) -> list:
+    return [f"Field {i}" for i in range(count)]
+
+
+def make_template(pages: int, tokens: int, image: bool = True, seed: int = 0) -> bytes:
+    """
+    A template with ``tokens`` "Field N: {{Field N}}" lines spread over
+    ``pages`` pages, plus a noise image per page so saves have real payload.
+    """
+    rng = random.Random(seed)
+    names = token_names(tokens)
+    per_page = max(1, -(-tokens // pages))
+
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        if image:
+            pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 160, 120), False)
+            pix.set_rect(pix.irect, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+            for _ in range(200):
+                pix.set_pixel(rng.randrange(160), rng.randrange(120), (rng.randrange(256),) * 3)
+            page.insert_image(fitz.Rect(400, 40, 560, 160), pixmap=pix)
+
+        y = 60
+        for name in names[p * per_page:(p + 1) * per_page]:
+            page.insert_text((50, y), f"{name}: {{{{{name}}}}}", fontname="helv", fontsize=9)
+            y += 14
+            if y > page.rect.height - 40:
+                y = 60
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def make_field_map(tokens: int) -> dict:
+    return {normalize_lookup_key(name): f"Value {i}" for i, name in enumerate(token_names(tokens))}
+
+
+def make_json(width: int, depth: int, seed: int = 0) -> dict:
+    """Nested extraction/GW-like document with ``width`` keys per level."""
+    rng = random.Random(seed)
+
+    def node(level):
+        if level == depth:
+            return rng.choice(["text", 1234.5, None, "null", 42])
+        out = {f"key{i}": node(level + 1) for i in range(width)}
+        out["items"] = [node(level + 1) for _ in range(max(1, width // 2))]
+        return out
+
+    doc = node(0)
+    doc["brokername"] = "Acme Brokers"
+    doc["totalpremiumamount"] = 1234.5
+    return doc
+
+
+def make_workbook(rows: int, seed: int = 0) -> bytes:
+    """Field/Value sheet like the meta/stubbed workbooks, mixing text and numbers."""
+    import openpyxl
+
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["Field", "Value"])
+    for i in range(rows):
+        ws.append([f"Field {i}", rng.choice([f"Value {i}", rng.randrange(10 ** 6), rng.random() * 1000, None])])
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
@@ -0,0 +1,128 @@
+import threading
+
+from config import AzureConf
+
+# requests and the Azure SDK are imported when the first client is built
+
+DEFAULT_POOL_SIZE = 32
+# Keeps streamed downloads (download_blob().chunks()) to bounded pieces
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+_lock = threading.Lock()
+_pool_size = DEFAULT_POOL_SIZE
+_transport = None
+_service_client = None
+_fetch_service_client = None
+_container_clients = {}
+_verified_containers = set()
+
+
+def _build_transport(pool_size: int):
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+
+    # One keep-alive session shared by every client, sized for the worker pools
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+
+def configure(pool_size: int = DEFAULT_POOL_SIZE) -> None:
+    """
+    Set the HTTP connection pool size. Drops any cached clients so the next
+    call builds them with the new transport.
+    """
+    global _pool_size, _transport, _service_client, _fetch_service_client
+    with _lock:
+        _pool_size = pool_size
+        _transport = None
+        _service_client = None
+        _fetch_service_client = None
+        _container_clients.clear()
+
+
+def _new_service_client(**kwargs):
+    global _transport
+    if not AzureConf.CONNECTION_STRING:
+        raise RuntimeError("Missing Azure storage configuration")
+    from azure.storage.blob import BlobServiceClient
+
+    if _transport is None:
+        _transport = _build_transport(_pool_size)
+    return BlobServiceClient.from_connection_string(
+        AzureConf.CONNECTION_STRING,
+        transport=_transport,
+        max_single_get_size=STREAM_CHUNK_SIZE,
+        max_chunk_get_size=STREAM_CHUNK_SIZE,
+        **kwargs,
+    )
+
+
+def get_blob_service_client():
+    global _service_client
+    client = _service_client
+    if client is not None:
+        return client
+
+    with _lock:
+        if _service_client is None:
+            _service_client = _new_service_client()
+        return _service_client
+
+
+def _get_fetch_service_client():
+    global _fetch_service_client
+    client = _fetch_service_client
+    if client is not None:
+        return client
+
+    with _lock:
+        if _fetch_service_client is None:
+            # fetch_policy.fetch owns retries and timeouts for these reads
+            _fetch_service_client = _new_service_client(retry_total=0)
+        return _fetch_service_client
+
+
+def get_container_client(container: str):
+    client = _container_clients.get(container)
+    if client is not None:
+        return client
+
+    bsc = get_blob_service_client()
+    with _lock:
+        return _container_clients.setdefault(container, bsc.get_container_client(container))
+
+
+def get_blob_client(container: str, blob_path: str):
+    return get_container_client(container).get_blob_client(blob_path)
+
+
+def get_fetch_blob_client(container: str, blob_path: str):
+    """Like get_blob_client, but without SDK retries, for reads run through fetch_policy.fetch."""
+    return _get_fetch_service_client().get_blob_client(container, blob_path)
+
+
+def ensure_container(container: str, create: bool = False) -> None:
+    """
+    Check once per process that a container exists. With ``create`` (for a
+    startup/bootstrap step) a missing container is created, otherwise it is
+    an error.
+    """
+    if container in _verified_containers:
+        return
+
+    container_client = get_container_client(container)
+    if not container_client.exists():
+        if not create:
+            raise RuntimeError(f"Blob container '{container}' does not exist")
+        from azure.core.exceptions import ResourceExistsError
+
+        try:
+            container_client.create_container()
+        except ResourceExistsError:
+            pass
+
+    with _lock:
+        _verified_containers.add(container)
@@ -0,0 +1,394 @@
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from blob_clients import DEFAULT_POOL_SIZE, get_fetch_blob_client
+from config import AzureConf
+from tracing import percentile, span, url_attr
+
+logger = logging.getLogger(__name__)
+
+_URL_QUERY = re.compile(r"(\w+://[^\s?#'\"]*)[?#][^\s'\"]*")
+
+
+class FetchPolicy:
+    """
+    Retry/timeout/hedging settings for one fetch.
+
+    attempts         full passes over the (SDK, HTTP) paths
+    attempt_timeout  seconds a single request may take before it is abandoned
+    backoff_base     first retry delay; doubles per attempt, with full jitter
+    backoff_max      cap on the retry delay
+    hedge_percentile once a request runs longer than this percentile of the
+                     path's recent latencies, a duplicate is started and the
+                     first success wins
+    hedge_min_samples latencies needed before hedging kicks in
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        attempt_timeout: float = 20.0,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+    ):
+        if attempts < 1:
+            raise ValueError(f"attempts must be at least 1, got {attempts}")
+        self.attempts = attempts
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+
+DEFAULT_POLICY = FetchPolicy()
+
+# A primary attempt and its hedge for every caller the connection pool is
+# sized for; abandoned attempts keep their thread until their own I/O times out
+_max_workers = 2 * DEFAULT_POOL_SIZE
+_executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="fetch")
+_in_flight = 0
+_lock = threading.Lock()
+_latencies = {}
+_served = Counter()
+_hedged = Counter()
+
+
+def configure(max_workers: int = 2 * DEFAULT_POOL_SIZE) -> None:
+    """
+    Size the attempt thread pool, e.g. to twice the callers' worker count when
+    that is raised past blob_clients' pool size. Running attempts finish on
+    the old pool.
+    """
+    global _executor, _max_workers
+    with _lock:
+        old = _executor
+        _max_workers = max_workers
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+    old.shutdown(wait=False)
+
+
+class _Attempt:
+    """One call of a fetch path; its deadline counts from when it starts running, not from submit."""
+
+    def __init__(self, fn, timeout: float):
+        global _in_flight
+        self.running = threading.Event()
+        self.started = None
+        with _lock:
+            _in_flight += 1
+            self.future = _executor.submit(self._run, fn, timeout)
+
+    def cancel(self) -> bool:
+        """Withdraw the call if it has not started running."""
+        global _in_flight
+        if not self.future.cancel():
+            return False
+        with _lock:
+            _in_flight -= 1
+        return True
+
+    def _run(self, fn, timeout):
+        global _in_flight
+        self.started = time.perf_counter()
+        self.running.set()
+        try:
+            return fn(timeout)
+        finally:
+            with _lock:
+                _in_flight -= 1
+
+
+def _has_idle_worker() -> bool:
+    with _lock:
+        return _in_flight < _max_workers
+
+
+def is_transient(exc: BaseException) -> bool:
+    # Only reached on a failure; keeps requests/azure out of module import
+    import requests
+    from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+    # ChunkedEncodingError: the connection broke while a body was being read
+    if isinstance(exc, (TimeoutError, requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError,
+                        ServiceRequestError, ServiceResponseError)):
+        return True
+    # aiohttp errors can only come from the async path, which has imported it
+    aiohttp = sys.modules.get("aiohttp")
+    if aiohttp is not None and isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return True
+
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+    elif isinstance(exc, HttpResponseError):
+        status = exc.status_code
+    elif aiohttp is not None and isinstance(exc, aiohttp.ClientResponseError):
+        status = exc.status
+    else:
+        return False
+    return status in (408, 429) or (status is not None and status >= 500)
+
+
+def _hedge_delay(path: str, policy: FetchPolicy):
+    with _lock:
+        samples = list(_latencies.get(path, ()))
+    if len(samples) < policy.hedge_min_samples:
+        return None
+    return percentile(samples, policy.hedge_percentile)
+
+
+def _record(path: str, elapsed: float, hedged: bool) -> None:
+    with _lock:
+        _latencies.setdefault(path, deque(maxlen=256)).append(elapsed)
+        _served[path] += 1
+        if hedged:
+            _hedged[path] += 1
+
+
+def _discard_late(futures, discard) -> None:
+    for fut in futures:
+        fut.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+
+def _run_hedged(path: str, fn, policy: FetchPolicy, discard):
+    primary = _Attempt(fn, policy.attempt_timeout)
+    # Time queued behind other attempts is not charged to this one, up to a
+    # timeout's worth; a call that never starts fails like one that hangs
+    if not primary.running.wait(policy.attempt_timeout) and primary.cancel():
+        raise TimeoutError(f"{path} fetch waited {policy.attempt_timeout}s for a free worker")
+    primary.running.wait()
+    start = primary.started
+    deadline = start + policy.attempt_timeout
+    futures = [primary.future]
+
+    delay = _hedge_delay(path, policy)
+    hedged = False
+    if delay is not None and delay < policy.attempt_timeout:
+        done, _ = wait(futures, timeout=delay)
+        # A hedge that would only queue cannot win the race
+        if not done and _has_idle_worker():
+            futures.append(_Attempt(fn, policy.attempt_timeout).future)
+            hedged = True
+
+    error = None
+    while futures:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            futures.remove(fut)
+            if fut.exception() is not None:
+                error = fut.exception()
+                continue
+            if discard is not None:
+                _discard_late(futures, discard)
+            _record(path, time.perf_counter() - start, hedged)
+            return fut.result()
+
+    if futures:
+        if discard is not None:
+            _discard_late(futures, discard)
+        raise TimeoutError(f"{path} fetch exceeded {policy.attempt_timeout}s")
+    raise error
+
+
+def _backoff(policy: FetchPolicy, attempt: int) -> float:
+    return random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** (attempt - 1)))
+
+
+def _log_failure(url: str, path: str, attempt: int, exc: BaseException) -> None:
+    # requests and aiohttp put the full URL, as they normalised it, in their error messages
+    logger.debug("fetch %s via %s failed (attempt %d): %s", url_attr(url), path, attempt + 1,
+                 _URL_QUERY.sub(r"\1", str(exc)))
+
+
+def fetch(url: str, paths: list, policy: FetchPolicy = None, discard=None):
+    """
+    Run the first path in ``paths`` ([(name, fn(timeout)), ...]) that
+    succeeds, falling back to the next one on error and retrying the whole
+    list with backoff while errors are transient. ``discard`` is called
+    with results of hedged duplicates that lost the race.
+    """
+    policy = policy or DEFAULT_POLICY
+    error = None
+    for attempt in range(policy.attempts):
+        if attempt:
+            time.sleep(_backoff(policy, attempt))
+
+        for path, fn in paths:
+            try:
+                result = _run_hedged(path, fn, policy, discard)
+            except Exception as e:
+                error = e
+                _log_failure(url, path, attempt, e)
+                continue
+            logger.debug("fetch %s served by %s (attempt %d)", url_attr(url), path, attempt + 1)
+            return result
+
+        if not is_transient(error):
+            break
+
+    raise error
+
+
+async def _run_hedged_async(path: str, fn, policy: FetchPolicy):
+    import asyncio
+
+    async def attempt():
+        try:
+            return await asyncio.wait_for(fn(policy.attempt_timeout), policy.attempt_timeout)
+        except asyncio.TimeoutError:
+            # Not the builtin TimeoutError before Python 3.11, see is_transient
+            raise TimeoutError(f"{path} fetch exceeded {policy.attempt_timeout}s") from None
+
+    def start():
+        return asyncio.ensure_future(attempt())
+
+    begun = time.perf_counter()
+    tasks = [start()]
+    hedged = False
+    try:
+        delay = _hedge_delay(path, policy)
+        if delay is not None and delay < policy.attempt_timeout:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.append(start())
+                hedged = True
+
+        error = None
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                _record(path, time.perf_counter() - begun, hedged)
+                return task.result()
+        raise error
+    finally:
+        # The loser of a hedged race is cancelled, which also closes its response
+        for task in tasks:
+            task.cancel()
+
+
+async def async_fetch(url: str, paths: list, policy: FetchPolicy = None):
+    """
+    fetch() for coroutines: ``paths`` is [(name, async fn(timeout)), ...].
+    Each attempt is bounded by asyncio.wait_for; retries, backoff, hedging
+    and the per-path stats are the same as for fetch().
+    """
+    import asyncio
+
+    policy = policy or DEFAULT_POLICY
+    error = None
+    for attempt in range(policy.attempts):
+        if attempt:
+            await asyncio.sleep(_backoff(policy, attempt))
+
+        for path, fn in paths:
+            try:
+                result = await _run_hedged_async(path, fn, policy)
+            except Exception as e:
+                error = e
+                _log_failure(url, path, attempt, e)
+                continue
+            logger.debug("fetch %s served by %s (attempt %d)", url_attr(url), path, attempt + 1)
+            return result
+
+        if not is_transient(error):
+            break
+
+    raise error
+
+
+def fetch_stats() -> dict:
+    """Requests served, hedged and p50/p99 latency (seconds) per path."""
+    with _lock:
+        stats = {}
+        for path, samples in _latencies.items():
+            stats[path] = {
+                "served": _served[path],
+                "hedged": _hedged[path],
+                "p50": percentile(samples, 0.50),
+                "p99": percentile(samples, 0.99),
+            }
+        return stats
+
+
+def is_azure_blob_url(url: str) -> bool:
+    try:
+        host = urlparse(url).netloc.lower()
+        return ".blob.core.windows.net" in host
+    except Exception:
+        return False
+
+
+def split_blob_url(url: str) -> tuple:
+    parsed = urlparse(url)
+    path = parsed.path.lstrip("/")
+    if "/" not in path:
+        raise ValueError(f"Invalid blob URL path: {path}")
+
+    container, blob_path = path.split("/", 1)
+    return container, blob_path
+
+
+def fetch_paths(url: str, via_azure, via_http) -> list:
+    # SDK first when the URL is a blob we hold credentials for, HTTP as fallback
+    paths = []
+    if is_azure_blob_url(url) and AzureConf.CONNECTION_STRING:
+        paths.append(("sdk", via_azure))
+    paths.append(("http", via_http))
+    return paths
+
+
+def _download_if_changed_via_azure(url: str, validators: dict, timeout: float = 60) -> tuple:
+    container, blob_path = split_blob_url(url)
+    blob_client = get_fetch_blob_client(container, blob_path)
+    server_timeout = max(1, int(timeout))
+    etag = blob_client.get_blob_properties(timeout=server_timeout).etag
+    if etag and etag == validators.get("etag"):
+        return None, validators
+    downloader = blob_client.download_blob(timeout=server_timeout)
+    return downloader.readall(), {"etag": downloader.properties.etag}
+
+
+def _download_if_changed_via_http(url: str, validators: dict, timeout: float = 60) -> tuple:
+    import requests
+
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    resp = requests.get(url, headers=headers, timeout=timeout)
+    if resp.status_code == 304:
+        return None, validators
+    resp.raise_for_status()
+    return resp.content, {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
+
+def download_if_changed(url: str, validators: dict, policy: FetchPolicy = None) -> tuple:
+    """
+    Conditional download. Returns (None, validators) when the resource still
+    matches the cached ETag / Last-Modified, otherwise (body, new_validators).
+    """
+    with span("download", url=url_attr(url)):
+        return fetch(url, fetch_paths(
+            url,
+            lambda timeout: _download_if_changed_via_azure(url, validators, timeout),
+            lambda timeout: _download_if_changed_via_http(url, validators, timeout),
+        ), policy)
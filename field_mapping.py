@@ -0,0 +1,97 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+DEFAULT_SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "field_map.json")
+
+_NON_ALNUM_RE = re.compile(r"[^a-zA-Z0-9]")
+
+FORMATTERS = {
+    "text": lambda v: v,
+    "dollar": lambda v: f"$ {v}",
+}
+
+
+@lru_cache(maxsize=4096)
+def _normalize_lookup_str(key: str) -> str:
+    key = key.strip()
+    if not key:
+        return ""
+
+    # Remove known prefixes
+    key = key.replace("SubDoc.", "").replace("GWResponse.", "")
+
+    # Remove everything except letters and numbers
+    key = _NON_ALNUM_RE.sub("", key)
+
+    return key.lower()
+
+
+def normalize_lookup_key(key) -> str:
+    if not isinstance(key, str):
+        return ""
+    return _normalize_lookup_str(key)
+
+
+def safe_get(flat_json: dict, key: str) -> str:
+    val = flat_json.get(key)
+    return "" if val in (None, "null") else str(val)
+
+
+def compile_field_spec(spec: dict) -> dict:
+    """
+    Compile a {pdf_field: rule} spec into flat lookup tables. A rule is one of
+      {"value": "..."}                                  stubbed constant
+      {"offset_days": n, "date_format": "%d/%m/%y"}     today + n days
+      {"source": "abc", "path": "a.b", "formatter": "dollar", "default": "..."}
+    PDF field names are normalized here, once, to the keys fill_pdf_form looks up.
+    """
+    constants = {}
+    dates = []
+    lookups = []
+    paths = {}
+
+    for pdf_field, rule in spec.items():
+        key = normalize_lookup_key(pdf_field)
+        if not key:
+            raise ValueError(f"Invalid PDF field name in mapping: {pdf_field!r}")
+
+        if "value" in rule:
+            constants[key] = str(rule["value"])
+        elif "offset_days" in rule:
+            dates.append((key, int(rule["offset_days"]), rule.get("date_format", "%d/%m/%y")))
+        elif "source" in rule and "path" in rule:
+            formatter_name = rule.get("formatter", "text")
+            if formatter_name not in FORMATTERS:
+                raise ValueError(f"Unknown formatter {formatter_name!r} for {pdf_field!r}")
+            lookups.append((key, rule["source"], rule["path"], rule.get("default", ""), FORMATTERS[formatter_name]))
+            paths.setdefault(rule["source"], []).append(rule["path"])
+        else:
+            raise ValueError(f"Unsupported mapping rule for {pdf_field!r}: {rule}")
+
+    return {
+        "constants": constants,
+        "dates": tuple(dates),
+        "lookups": tuple(lookups),
+        "paths": {source: tuple(dict.fromkeys(p)) for source, p in paths.items()},
+    }
+
+
+def load_field_spec(path: str = DEFAULT_SPEC_PATH) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_field_spec(json.load(f))
+
+
+def apply_field_spec(compiled: dict, sources: dict, today: datetime = None) -> dict:
+    today = today or datetime.today()
+
+    field_map = dict(compiled["constants"])
+    for key, offset_days, date_format in compiled["dates"]:
+        field_map[key] = (today + timedelta(days=offset_days)).strftime(date_format)
+
+    for key, source, path, default, formatter in compiled["lookups"]:
+        field_map[key] = formatter(safe_get(sources[source], path) or default)
+
+    return field_map
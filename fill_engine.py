@@ -0,0 +1,141 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_fill import build_template_index, fill_pdf_form
+
+ENGINE_DIR = os.path.join(tempfile.gettempdir(), "quote-fill-engine")
+
+# Worker-process state: template_id -> (version, template_bytes, template_index)
+_worker_templates = {}
+
+
+def _worker_fill(template_id: str, version: str, path: str, field_map: dict, options: dict) -> bytes:
+    cached = _worker_templates.get(template_id)
+    if cached is None or cached[0] != version:
+        with open(path, "rb") as f:
+            template_bytes, template_index = pickle.load(f)
+        cached = (version, template_bytes, template_index)
+        _worker_templates[template_id] = cached
+    return fill_pdf_form(cached[1], field_map, cached[2], **options)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class FillEngine:
+    """
+    Process pool for fill_pdf_form. Templates are registered once and
+    handed to workers through a file; each worker loads a template on first
+    use and keeps it, so jobs only carry (template_id, field_map).
+
+    Template files live in a directory of this engine's own. A file replaced
+    by re-registering its id is deleted once no queued job needs it, and the
+    directory goes on shutdown().
+
+    Workers are started by forkserver (spawn where that is unavailable), so
+    a script that uses an engine needs an ``if __name__ == "__main__":`` guard.
+    """
+
+    def __init__(self, max_workers: int = None):
+        # Forking a process that runs client threads and open connections can
+        # leave a worker holding a lock no thread will release
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_mp_context())
+        self._templates = {}
+        # path -> jobs submitted and not finished; retired paths are deleted at 0
+        self._pending = {}
+        self._retired = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        os.makedirs(ENGINE_DIR, exist_ok=True)
+        self._dir = tempfile.mkdtemp(prefix="engine-", dir=ENGINE_DIR)
+
+    def register_template(self, template_id: str, template_bytes: bytes, template_index: list = None) -> None:
+        version = hashlib.sha1(template_bytes).hexdigest()
+        with self._lock:
+            current = self._templates.get(template_id)
+            if current is not None and current[0] == version:
+                return
+
+        if template_index is None:
+            template_index = build_template_index(template_bytes)
+
+        path = os.path.join(self._dir, f"{version}.pkl")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((template_bytes, template_index), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            previous = self._templates.get(template_id)
+            self._templates[template_id] = (version, path)
+            self._retired.discard(path)
+            if previous is not None and previous[1] != path:
+                self._retire(previous[1])
+
+    def _retire(self, path: str) -> None:
+        # Called with self._lock held
+        if any(p == path for _, p in self._templates.values()):
+            return
+        if self._pending.get(path):
+            self._retired.add(path)
+        else:
+            _remove(path)
+
+    def _release(self, path: str) -> None:
+        with self._lock:
+            self._pending[path] -= 1
+            if self._pending[path]:
+                return
+            del self._pending[path]
+            if path in self._retired:
+                self._retired.discard(path)
+                _remove(path)
+            if self._closed and not self._pending:
+                shutil.rmtree(self._dir, ignore_errors=True)
+
+    def has_template(self, template_id: str) -> bool:
+        with self._lock:
+            return template_id in self._templates
+
+    def submit(self, template_id: str, field_map: dict, **options):
+        with self._lock:
+            if template_id not in self._templates:
+                raise KeyError(f"Template not registered: {template_id}")
+            version, path = self._templates[template_id]
+            future = self._pool.submit(_worker_fill, template_id, version, path, field_map, options)
+            self._pending[path] = self._pending.get(path, 0) + 1
+        future.add_done_callback(lambda _: self._release(path))
+        return future
+
+    def fill(self, template_id: str, field_map: dict, **options) -> bytes:
+        return self.submit(template_id, field_map, **options).result()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+        with self._lock:
+            self._closed = True
+            # Otherwise the last job to finish removes it, see _release
+            if not self._pending:
+                shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
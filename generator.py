@@ -1,3 +1,16 @@
+import io
+import json
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+from blob_clients import ensure_container, get_blob_client, get_container_client
+from config import AzureConf
+from fetch_policy import download_if_changed
+from utils import first_non_empty, mmddyyyy, normalize_key, pretty_date
+
+# openpyxl and PyMuPDF (fitz, pdf_fill) are imported on first use
+
 def _is_azure_blob_url(url: str) -> bool:
     try:
         host = urlparse(url).netloc.lower()
@@ -12,11 +25,12 @@ def _download_via_azure(url: str) -> bytes:
         raise ValueError(f"Invalid blob URL path: {path}")
     container, blob_path = path.split("/", 1)
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    blob_client = bsc.get_container_client(container).get_blob_client(blob_path)
+    blob_client = get_blob_client(container, blob_path)
     return blob_client.download_blob().readall()
 
 def _download_bytes(url: str) -> bytes:
+    import requests
+
     if _is_azure_blob_url(url) and AzureConf.CONNECTION_STRING:
         try:
             return _download_via_azure(url)
@@ -29,25 +43,177 @@ def _download_bytes(url: str) -> bytes:
     resp.raise_for_status()
     return resp.content
 
+# Strings pandas.read_excel treated as missing; kept so values read the same
+_EXCEL_NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+_EXCEL_CACHE = {}
+_EXCEL_CACHE_LOCK = threading.Lock()
+
+def _excel_to_dict(content: bytes) -> dict:
+    # Streams the first sheet row by row (read_only + values_only) instead of
+    # building a DataFrame for what is a two-column key/value sheet
+    import openpyxl
+
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return {}
+
+        cols = ["" if c is None else str(c).strip() for c in header]
+        if "Field" in cols and "Value" in cols:
+            key_col, val_col = cols.index("Field"), cols.index("Value")
+        elif len(cols) >= 2:
+            key_col, val_col = 0, 1
+        else:
+            return {}
+
+        out = {}
+        for row in rows:
+            key = row[key_col] if key_col < len(row) else None
+            key = "" if key is None else str(key).strip()
+            if not key:
+                continue
+            val = row[val_col] if val_col < len(row) else None
+            if isinstance(val, str) and val in _EXCEL_NA_VALUES:
+                val = None
+            out[normalize_key(key)] = None if val is None else str(val).strip()
+        return out
+    finally:
+        wb.close()
+
 def _read_excel_to_dict_url(url: str) -> dict:
-    content = _download_bytes(url)
-    df = pd.read_excel(io.BytesIO(content), engine="openpyxl")
-    out = {}
-    cols = [str(c).strip() for c in df.columns]
-    if "Field" in cols and "Value" in cols:
-        for _, row in df.iterrows():
-            key = str(row["Field"]).strip()
-            val = None if pd.isna(row["Value"]) else str(row["Value"]).strip()
-            if key:
-                out[normalize_key(key)] = val
-    else:
-        if df.shape[1] >= 2:
-            for _, row in df.iterrows():
-                key = str(row.iloc[0]).strip()
-                val = None if pd.isna(row.iloc[1]) else str(row.iloc[1]).strip()
-                if key:
-                    out[normalize_key(key)] = val
-    return out
+    """
+    Read a Field/Value workbook into {normalized key: value}. Parsed sheets
+    are cached per URL and only re-downloaded when their ETag changes.
+    """
+    with _EXCEL_CACHE_LOCK:
+        cached = _EXCEL_CACHE.get(url)
+
+    content, validators = download_if_changed(url, cached[0] if cached else {})
+    if content is None:
+        return dict(cached[1])
+
+    out = _excel_to_dict(content)
+    if validators.get("etag") or validators.get("last_modified"):
+        with _EXCEL_CACHE_LOCK:
+            _EXCEL_CACHE[url] = (validators, out)
+    return dict(out)
+
+def _fold_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+class _LabelMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of labels: one pass over a
+    page's text finds every label in it. Matching ignores case and treats
+    whitespace runs as one space, so it never misses a label that
+    page.search_for would find.
+    """
+
+    def __init__(self, labels):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for label in labels:
+            state = 0
+            for ch in _fold_text(label):
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (label,)
+
+        # Breadth-first, so every fail target is finished before it is used
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text: str) -> set:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in _fold_text(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+def _prefer_value(field_name, extracted_map, meta_map, stubbed_map):
+    nk = normalize_key(field_name)
+    v_ex = extracted_map.get(nk)
+    v_meta = meta_map.get(nk)
+    v_stub = stubbed_map.get(nk)
+    return first_non_empty(v_ex, v_meta, v_stub)
+
+def fill_pdf_form(template_bytes: bytes, extracted_map: dict, meta_map: dict, stubbed_map: dict) -> bytes:
+    import fitz  # PyMuPDF
+    from pdf_fill import _collect_tokens, _place_next_to_label, _replace_token
+
+    doc = fitz.open(stream=template_bytes, filetype="pdf")
+
+    all_page_tokens = []
+    for page in doc:
+        all_page_tokens.extend(_collect_tokens(page.get_text("text")))
+    all_page_tokens = list(dict.fromkeys(all_page_tokens))
+
+    data_keys = set(list(meta_map.keys()) + list(stubbed_map.keys()) + list(extracted_map.keys()))
+    token_keys = {normalize_key(t) for t in all_page_tokens}
+
+    # (label, value) for data keys without a token; "named insured" -> "Named Insured:"
+    fallback_labels = []
+    for nk in data_keys:
+        if not nk or nk in token_keys or not nk.split():
+            continue
+        val = first_non_empty(extracted_map.get(nk), meta_map.get(nk), stubbed_map.get(nk))
+        if val:
+            fallback_labels.append((f"{' '.join(w.capitalize() for w in nk.split())}:", val))
+    label_matcher = _LabelMatcher(label for label, _ in fallback_labels)
+
+    for page in doc:
+        page_text = page.get_text("text")
+        tokens = _collect_tokens(page_text)
+        for raw_token in tokens:
+            token_variants = [f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"]
+            value = _prefer_value(raw_token, extracted_map, meta_map, stubbed_map)
+            if value is None:
+                continue
+            for tv in token_variants:
+                _replace_token(page, tv, value)
+
+        for raw_token in tokens:
+            value = _prefer_value(raw_token, extracted_map, meta_map, stubbed_map)
+            if value is None:
+                continue
+            _place_next_to_label(page, f"{raw_token.strip()}:", value)
+
+        # One pass over the page text; only labels present there are searched for
+        present = label_matcher.find(page_text)
+        for label, val in fallback_labels:
+            if label in present:
+                _place_next_to_label(page, label, val)
+
+    out = io.BytesIO()
+    doc.save(out, deflate=True)
+    doc.close()
+    return out.getvalue()
 
 def _compose_filename(extracted_map: dict, meta_map: dict, stubbed_map: dict) -> str:
     def prefer_key(*names):
@@ -74,15 +240,12 @@ def _upload_pdf(filename: str, pdf_bytes: bytes) -> str:
     if not (AzureConf.CONNECTION_STRING and AzureConf.ACCOUNT_URL):
         raise RuntimeError("Missing Azure storage configuration: AZURE_STORAGE_CONNECTION_STRING and AZURE_STORAGE_ACCOUNT_URL")
 
+    from azure.storage.blob import ContentSettings
+
     container_name = "quotes-output"  # fixed target container per your requirement
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    container_client = bsc.get_container_client(container_name)
-    try:
-        container_client.create_container()
-    except Exception:
-        # Container may already exist or permission may already be set; safe to proceed
-        pass
+    ensure_container(container_name)
+    container_client = get_container_client(container_name)
 
     blob_client = container_client.get_blob_client(filename)
     blob_client.upload_blob(
@@ -93,6 +256,8 @@ def _upload_pdf(filename: str, pdf_bytes: bytes) -> str:
     return f"{AzureConf.ACCOUNT_URL}/{container_name}/{filename}"
 
 def generate_quote(extracted_json_url: str, meta_excel_url: str, stubbed_excel_url: str, pdf_template_url: str):
+    from quote_generator import flatten_json
+
     try:
         extracted_bytes = _download_bytes(extracted_json_url)
         extracted_json = json.loads(extracted_bytes.decode("utf-8"))
@@ -109,30 +274,3 @@ def generate_quote(extracted_json_url: str, meta_excel_url: str, stubbed_excel_u
         return {"error": False, "url": blob_url}
     except Exception as e:
         return {"error": True, "error_message": str(e)}
-
-
-
-the above code is framed for generating the quote using the excel but now i want to generate a quote using the data direclty from the json file stored in azure blob. Please make the changes in the according to the new requirement.
-Also i want to change the mapping of the pdf fields, the new mapping is as below: -
-1.Broker & Client Details:
-Broker Name: SubDoc.BrokerName The values from the input url should be fetched and fill in the place of"SubDoc.BrokerName"( (Should be fetched from the 2 input blob url)
-Broker Company: SubDoc.OragnizationName The values from the input url should be fetched and fill in the place of "SubDoc.OragnizationName"(Should be fetched from the 2 input blob url)
-Broker Email: SubDoc.BrokerEmail  The values from the input url should be fetched and fill in the place of"SubDoc.BrokerEmail"  (Should be fetched from the 2 input blob url) 
-Insured Name: SubDoc.NamedInsured  The values from the input url should be fetched and fill in the place of"SubDoc.NamedInsured"  (Should be fetched from the 2 input blob url)
-Risk Location Address: SubDoc.NameandMailingAddress The values from the input url should be fetched and fill in the place of" SubDoc.NameandMailingAddress"  (Should be fetched from the 2 input blob url) 
-Quote Date: current date dd/mm/yy (Should have the logic on the code itself)
-Quote Expiry Date: current date + 30days (Should have the logic on the code itself)
-
-2.Coverage Summary
- 
-Type of Cover: Commercial Property (Stubbed)
-Coverage Basis: Fire & Allied Perils (Stubbed)
-Policy Period From: SubDoc.EffectiveDate The values from the input url should be fetched and fill in the place of "SubDoc.EffectiveDate" (Should be fetched from the 2 input blob url)
-Policy Period To: SubDoc.ExpirationDate The values from the input url should be fetched and fill in the place of "SubDoc.ExpirationDate" (Should be fetched from the 2 input blob url)
-Total Sum Insured: SubDoc.LimitofLiabilit The values from the input url should be fetched and fill in the place of "SubDoc.LimitofLiabilit" (Should be fetched from the 2 input blob url)
- 
-3.Premium Summary 
-Total Payable Premium: $  GWResponse.totalPremium.amount The values from the input url should be fetched and fill in the place of"$ GWResponse.totalPremium.amount" (Should be fetched from the 2 input blob url)
-Taxes: $ GWResponse.taxesandSurcharges.amount The values from the input url should be fetched and fill in the place of"$ GWResponse.taxesandSurcharges.amoun" (Should be fetched from the 2 input blob url).
-
-Accordingly make changes in the code and give me the complete new code.
@@ -1,32 +1,96 @@
-def _white_and_write(page, rect, text, fontsize=10, width_pad=220):
-    pad = 1.5
-    wrect = fitz.Rect(rect.x0 - pad, rect.y0 - pad, rect.x1 + width_pad, rect.y1 + pad)
-    page.draw_rect(wrect, fill=(1, 1, 1), color=None, stroke_opacity=0, fill_opacity=1, overlay=True)
-    page.insert_textbox(wrect, str(text), fontname="helv", fontsize=fontsize, color=(0, 0, 0), align=0)
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import fitz  # PyMuPDF
+from field_mapping import normalize_lookup_key
+from tracing import span
+from utils import fmt_thousands, is_numeric_like
+
+# Bumped whenever the shape of build_template_index() entries changes
+TEMPLATE_INDEX_VERSION = 2
+
+_DOUBLE_BRACE_TOKEN_RE = re.compile(r"{{(.+?)}}")
+_SINGLE_BRACE_TOKEN_RE = re.compile(r"{([^}]+)}}")
+
+class _PageStamp:
+    """
+    Draws a page's white-outs and values through one Shape where it can.
+    Shape.commit() writes all drawings before all text, so before a white-out
+    that overlaps text already in the shape, that text is moved into the
+    drawing stream, or, where Shape does not expose it, the shape is
+    committed; either way the white-out still covers it.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.shape = None
+        self._text_rects = []
+
+    def white_and_write(self, rect, text, fontsize=10, width_pad=220):
+        pad = 1.5
+        wrect = fitz.Rect(rect.x0 - pad, rect.y0 - pad, rect.x1 + width_pad, rect.y1 + pad)
+        if any(wrect.intersects(r) for r in self._text_rects):
+            if not self._move_text_into_stream():
+                self.commit()
+            self._text_rects = []
+        if self.shape is None:
+            self.shape = self.page.new_shape()
+        self.shape.draw_rect(wrect)
+        self.shape.finish(fill=(1, 1, 1), color=None, stroke_opacity=0, fill_opacity=1)
+        unused = self.shape.insert_textbox(wrect, str(text), fontname="helv", fontsize=fontsize, color=(0, 0, 0), align=0)
+        # Text fills the box from the top; only that part can be covered later
+        self._text_rects.append(fitz.Rect(wrect.x0, wrect.y0, wrect.x1, wrect.y1 - max(unused, 0)))
+
+    def _move_text_into_stream(self) -> bool:
+        text = getattr(self.shape, "text_cont", None)
+        stream = getattr(self.shape, "totalcont", None)
+        if not (isinstance(text, str) and isinstance(stream, str)):
+            return False
+        self.shape.totalcont = stream + text
+        self.shape.text_cont = ""
+        return True
+
+    def commit(self):
+        if self.shape is not None:
+            self.shape.commit(overlay=True)
+            self.shape = None
+            self._text_rects = []
+
+def _format_value(value):
+    return fmt_thousands(value) if is_numeric_like(value) else value
+
+def _write_next_to_label(stamp, r, out_val, line_offset=0, width=420):
+    dy = (r.y1 - r.y0 + 12) * line_offset
+    target = fitz.Rect(r.x1 + 6, r.y0 + dy - 1.5, r.x1 + width, r.y1 + dy + 10)
+    stamp.white_and_write(target, out_val, width_pad=width - (r.x1 - r.x0))
 
 def _replace_token(page, token_text, value):
     rects = page.search_for(token_text)
     if not rects:
         return False
-    out_val = fmt_thousands(value) if is_numeric_like(value) else value
+    out_val = _format_value(value)
+    stamp = _PageStamp(page)
     for r in rects:
-        _white_and_write(page, r, out_val)
+        stamp.white_and_write(r, out_val)
+    stamp.commit()
     return True
 
 def _place_next_to_label(page, label_text, value, line_offset=0, width=420):
     rects = page.search_for(label_text)
     if not rects:
         return False
-    r = rects[0]
-    dy = (r.y1 - r.y0 + 12) * line_offset
-    target = fitz.Rect(r.x1 + 6, r.y0 + dy - 1.5, r.x1 + width, r.y1 + dy + 10)
-    out_val = fmt_thousands(value) if is_numeric_like(value) else value
-    _white_and_write(page, target, out_val, width_pad=width - (r.x1 - r.x0))
+    stamp = _PageStamp(page)
+    _write_next_to_label(stamp, rects[0], _format_value(value), line_offset, width)
+    stamp.commit()
     return True
 
 def _collect_tokens(page_text):
-    tokens = re.findall(r"{{(.+?)}}", page_text)
-    tokens += [m for m in re.findall(r"{([^}]+)}}", page_text) if "{{" not in m]
+    tokens = _DOUBLE_BRACE_TOKEN_RE.findall(page_text)
+    tokens += [m for m in _SINGLE_BRACE_TOKEN_RE.findall(page_text) if "{{" not in m]
     uniq = []
     seen = set()
     for t in tokens:
@@ -35,274 +99,264 @@ def _collect_tokens(page_text):
             seen.add(t)
     return uniq
 
-def _prefer_value(field_name, extracted_map, meta_map, stubbed_map):
-    nk = normalize_key(field_name)
-    v_ex = extracted_map.get(nk)
-    v_meta = meta_map.get(nk)
-    v_stub = stubbed_map.get(nk)
-    return first_non_empty(v_ex, v_meta, v_stub)
-
-def fill_pdf_form(template_bytes: bytes, extracted_map: dict, meta_map: dict, stubbed_map: dict) -> bytes:
-    doc = fitz.open(stream=template_bytes, filetype="pdf")
-
-    all_page_tokens = []
-    for page in doc:
-        all_page_tokens.extend(_collect_tokens(page.get_text("text")))
-    all_page_tokens = list(dict.fromkeys(all_page_tokens))
-
-    data_keys = set(list(meta_map.keys()) + list(stubbed_map.keys()) + list(extracted_map.keys()))
-    fallback_label_candidates = [k for k in data_keys if k and k not in [normalize_key(t) for t in all_page_tokens]]
-
-    for page in doc:
-        page_text = page.get_text("text")
-        tokens = _collect_tokens(page_text)
-        for raw_token in tokens:
-            token_variants = [f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"]
-            value = _prefer_value(raw_token, extracted_map, meta_map, stubbed_map)
-            if value is None:
+def _lower(text: str) -> str:
+    # Index-preserving lower(): some characters lowercase to two ('İ' -> 'i̇'),
+    # which would shift every match after them off its char boxes
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+def _page_lines(page) -> list:
+    """
+    Extract a page's text once as (text, lowered_text, char_boxes) per line,
+    with one bbox per character so matches map straight back to rects.
+    """
+    lines = []
+    for block in page.get_text("rawdict")["blocks"]:
+        for line in block.get("lines", ()):
+            chars = [c for span in line["spans"] for c in span["chars"]]
+            if not chars:
                 continue
-            for tv in token_variants:
-                _replace_token(page, tv, value)
-
-        for raw_token in tokens:
-            if _prefer_value(raw_token, extracted_map, meta_map, stubbed_map) is None:
-                continue
-            label = f"{raw_token.strip()}:"
-            _place_next_to_label(page, label, _prefer_value(raw_token, extracted_map, meta_map, stubbed_map))
-
-        for nk in fallback_label_candidates:
-            words = nk.split()
-            if not words:
-                continue
-            label = f"{' '.join(w.capitalize() for w in words)}:"
-            val = first_non_empty(extracted_map.get(nk), meta_map.get(nk), stubbed_map.get(nk))
-            if val:
-                _place_next_to_label(page, label, val)
-
-    out = io.BytesIO()
-    doc.save(out, deflate=True)
-    doc.close()
-    return out.getvalue()
-
-
-
-
----- changes
-
-
-def fill_pdf_form(template_bytes: bytes, field_map: dict) -> bytes:
-    doc = fitz.open(stream=template_bytes, filetype="pdf")
-
-    all_page_tokens = []
+            text = "".join(c["c"] for c in chars)
+            lines.append((text, _lower(text), [c["bbox"] for c in chars]))
+    return lines
+
+def _find_text(lines, needle) -> list:
+    # Case-insensitive, non-overlapping, like page.search_for
+    needle = _lower(needle)
+    rects = []
+    for _, lowered, boxes in lines:
+        start = lowered.find(needle)
+        while start != -1:
+            end = start + len(needle)
+            hit = boxes[start:end]
+            rects.append((
+                min(b[0] for b in hit), min(b[1] for b in hit),
+                max(b[2] for b in hit), max(b[3] for b in hit),
+            ))
+            start = lowered.find(needle, end)
+    return rects
+
+def _index_document(doc) -> list:
+    index = []
     for page in doc:
-        all_page_tokens.extend(_collect_tokens(page.get_text("text")))
-    all_page_tokens = list(dict.fromkeys(all_page_tokens))
-
-    for page in doc:
-        page_text = page.get_text("text")
-        tokens = _collect_tokens(page_text)
-
-        # Replace {{tokens}}
-        for raw_token in tokens:
-            value = field_map.get(raw_token)
-            if value in (None, ""):
-                continue
-
-            token_variants = [f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"]
-            for tv in token_variants:
-                _replace_token(page, tv, value)
-
-        # Place next to labels
-        for raw_token in tokens:
-            value = field_map.get(raw_token)
-            if value in (None, ""):
-                continue
-
-            label = f"{raw_token.strip()}:"
-            _place_next_to_label(page, label, value)
-
-    out = io.BytesIO()
-    doc.save(out, deflate=True)
-    doc.close()
-    return out.getvalue()
-
-
-
-
-
--------------------
-def fill_pdf_form(template_bytes: bytes, field_map: dict) -> bytes:
+        lines = _page_lines(page)
+        entries = []
+        for raw_token in _collect_tokens("\n".join(text for text, _, _ in lines)):
+            token_rects = []
+            for tv in (f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"):
+                token_rects.extend(_find_text(lines, tv))
+            label_rects = _find_text(lines, f"{raw_token.strip()}:")
+            label_rect = label_rects[0] if label_rects else None
+            entries.append((raw_token, normalize_lookup_key(raw_token), token_rects, label_rect))
+        index.append(entries)
+    return index
+
+def build_template_index(template_bytes: bytes) -> list:
+    """
+    Locate every token and its label in the template once. Returns one list
+    per page of (raw_token, lookup_key, token_rects, label_rect) entries, with
+    rects as plain (x0, y0, x1, y1) tuples so the index can be cached and
+    pickled.
+    """
     doc = fitz.open(stream=template_bytes, filetype="pdf")
-
-    all_page_tokens = []
-    for page in doc:
-        all_page_tokens.extend(_collect_tokens(page.get_text("text")))
-    all_page_tokens = list(dict.fromkeys(all_page_tokens))
-
-    for page in doc:
-        page_text = page.get_text("text")
-        print("PAGE TEXT:")
-        print(page.get_text("text"))
-        tokens = _collect_tokens(page_text)
-
-        # Replace {{tokens}}
-        for raw_token in tokens:
-            value = field_map.get(raw_token)
-            if value in (None, ""):
-                continue
-
-            token_variants = [f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"]
-            for tv in token_variants:
-                _replace_token(page, tv, value)
-
-        # Place next to labels
-        for raw_token in tokens:
-            value = field_map.get(raw_token)
-            if value in (None, ""):
-                continue
-
-            label = f"{raw_token.strip()}:"
-            _place_next_to_label(page, label, value)
-
-    out = io.BytesIO()
-    doc.save(out, deflate=True)
-    doc.close()
-    return out.getvalue()
-
-
---------- change 2
-def fill_pdf_form(template_bytes: bytes, field_map: dict) -> bytes:
-    doc = fitz.open(stream=template_bytes, filetype="pdf")
-
-    for page in doc:
-        page_text = page.get_text("text")
-        print("PAGE TEXT:")
-        print(page_text)
-
-        for pdf_key, value in field_map.items():
-            if value in (None, ""):
-                continue
-
-            # SubDoc.BrokerName -> Broker Name
-            label_text = pdf_key.split(".")[-1]
-            label_text = re.sub(r"([a-z])([A-Z])", r"\1 \2", label_text)
-
-            placed = _place_next_to_label(page, f"{label_text}:", value)
-
-            if not placed:
-                _replace_token(page, pdf_key, value)
+    try:
+        return _index_document(doc)
+    finally:
+        doc.close()
+
+_VALUE_WIDGET_TYPES = (
+    fitz.PDF_WIDGET_TYPE_TEXT,
+    fitz.PDF_WIDGET_TYPE_COMBOBOX,
+    fitz.PDF_WIDGET_TYPE_LISTBOX,
+)
+
+def _fill_widgets(page, field_map) -> None:
+    for widget in page.widgets(types=_VALUE_WIDGET_TYPES):
+        value = field_map.get(normalize_lookup_key(widget.field_name))
+        if value in (None, ""):
+            continue
+        widget.field_value = str(_format_value(value))
+        widget.update()
+
+INCREMENTAL_WORK_DIR = os.path.join(tempfile.gettempdir(), "quote-fill")
+
+_incremental_bases = {}
+_incremental_lock = threading.Lock()
+
+def _incremental_base(template_bytes: bytes) -> str:
+    # One on-disk copy of each template per process; MuPDF can only append
+    # an incremental update to a document that was opened from a file.
+    digest = hashlib.sha1(template_bytes).hexdigest()
+    with _incremental_lock:
+        path = _incremental_bases.get(digest)
+        if path is None or not os.path.exists(path):
+            os.makedirs(INCREMENTAL_WORK_DIR, exist_ok=True)
+            path = os.path.join(INCREMENTAL_WORK_DIR, f"{digest}.pdf")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(template_bytes)
+            os.replace(tmp_path, path)
+            _incremental_bases[digest] = path
+    return path
+
+def _open_incremental_copy(template_bytes: bytes):
+    base_path = _incremental_base(template_bytes)
+    fd, work_path = tempfile.mkstemp(suffix=".pdf", dir=INCREMENTAL_WORK_DIR)
+    os.close(fd)
+    shutil.copyfile(base_path, work_path)
+    return fitz.open(work_path), work_path
+
+def _save_document(doc, work_path, output=None):
+    if work_path is not None and doc.can_save_incrementally():
+        doc.saveIncr()
+        doc.close()
+        with open(work_path, "rb") as f:
+            if output is None:
+                return f.read()
+            shutil.copyfileobj(f, output)
+            return output
+
+    if output is not None:
+        doc.save(output, deflate=True)
+        return output
 
     out = io.BytesIO()
     doc.save(out, deflate=True)
-    doc.close()
     return out.getvalue()
 
-
--0--------------------------
-def build_pdf_field_map(abc_json: dict, gw_json: dict) -> dict:
-    today = datetime.today()
-    quote_date = today.strftime("%d/%m/%y")
-    expiry_date = (today + timedelta(days=30)).strftime("%d/%m/%y")
-
-    return {
-        "SubDoc.BrokerName": safe_get(abc_json, "Broker Name"),
-        "SubDoc.OragnizationName": safe_get(abc_json, "Oragnization Name"),
-        "SubDoc.BrokerEmail": safe_get(abc_json, "Broker Email"),
-        "SubDoc.NamedInsured": safe_get(abc_json, "Named Insured"),
-        "SubDoc.NameandMailingAddress": safe_get(abc_json, "Name and Mailing Address"),
-
-        "QuoteDate": quote_date,
-        "QuoteExpiryDate": expiry_date,
-
-        "TypeOfCover": "Commercial Property",
-        "CoverageBasis": "Fire & Allied Perils",
-
-        "SubDoc.EffectiveDate": safe_get(abc_json, "Effective Date"),
-        "SubDoc.ExpirationDate": safe_get(abc_json, "Expiration Date"),
-        "SubDoc.LimitofLiabilit": safe_get(abc_json, "Limit of Liability"),
-
-        "TotalPayablePremium": f"$ {safe_get(gw_json, 'totalPremium.amount')}",
-        "Taxes": f"$ {safe_get(gw_json, 'taxesandSurcharges.amount')}",
-    }
-
-
-
------------ vhange 2
-
-def fill_pdf_form(template_bytes: bytes, field_map: dict) -> bytes:
-    doc = fitz.open(stream=template_bytes, filetype="pdf")
-
-    for page in doc:
-        page_text = page.get_text("text")
-        tokens = _collect_tokens(page_text)
-
-        for raw_token in tokens:
-            lookup_key = normalize_lookup_key(raw_token)
+def fill_pdf_form(
+    template_bytes: bytes,
+    field_map: dict,
+    template_index: list = None,
+    flatten: bool = False,
+    incremental: bool = False,
+    output=None,
+):
+    """
+    AcroForm templates get their text/choice widgets set directly (and baked
+    into page content when ``flatten``); {{token}} placeholders are stamped
+    over with the white-out overlay.
+
+    With ``incremental`` the output is the untouched template followed by an
+    incremental update holding only the changed objects, instead of a full
+    rewrite and recompression of every object.
+
+    Returns the PDF as bytes, or, when a writable ``output`` file object is
+    given, writes straight into it and returns it without an extra copy.
+    """
+    work_path = None
+    with span("fill.open"):
+        if incremental:
+            doc, work_path = _open_incremental_copy(template_bytes)
+        else:
+            doc = fitz.open(stream=template_bytes, filetype="pdf")
+
+    try:
+        _fill_document(doc, field_map, template_index, flatten)
+        with span("fill.save"):
+            return _save_document(doc, work_path, output)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+        if work_path is not None:
+            os.remove(work_path)
+
+def _fill_document(doc, field_map, template_index, flatten) -> None:
+    if template_index is None:
+        with span("fill.search"):
+            template_index = _index_document(doc)
+
+    with span("fill.draw"):
+        _draw_document(doc, field_map, template_index, flatten)
+
+def _draw_document(doc, field_map, template_index, flatten) -> None:
+    if doc.is_form_pdf:
+        for page in doc:
+            _fill_widgets(page, field_map)
+        if flatten:
+            doc.bake(annots=False, widgets=True)
+
+    _stamp_pages(doc, field_map, template_index)
+
+def _stamp_pages(pages, field_map, template_index) -> None:
+    # One _PageStamp per page, usually a single content stream for all its values
+    for page, entries in zip(pages, template_index):
+        stamp = _PageStamp(page)
+        for _, lookup_key, token_rects, label_rect in entries:
             value = field_map.get(lookup_key)
 
             if value in (None, ""):
                 continue
 
-            token_variants = [f"{{{{{raw_token}}}}}", f"{{{raw_token}}}"]
-            for tv in token_variants:
-                _replace_token(page, tv, value)
-
-            label = f"{raw_token.strip()}:"
-            _place_next_to_label(page, label, value)
-
-    out = io.BytesIO()
-    doc.save(out, deflate=True)
-    doc.close()
-    return out.getvalue()
-
-
-
-_______
-
-def normalize_lookup_key(key) -> str:
-    if not isinstance(key, str):
-        return ""
-
-    key = key.strip()
-    if not key:
-        return ""
-
-    # Remove known prefixes
-    key = key.replace("SubDoc.", "").replace("GWResponse.", "")
-
-    # Remove everything except letters and numbers
-    key = re.sub(r"[^a-zA-Z0-9]", "", key)
-
-    return key.lower()
-
-_______&__
-def build_pdf_field_map(abc_data: dict, gw_data: dict) -> dict:
-    today = datetime.today()
-    quote_date = today.strftime("%d/%m/%y")
-    expiry_date = (today + timedelta(days=30)).strftime("%d/%m/%y")
-
-    return {
-        # -------- Broker / Insured (ABC) --------
-        "brokername": safe_get(abc_data, "brokername"),
-        "oragnizationname": safe_get(abc_data, "oragnizationname"),
-        "brokeremail": safe_get(abc_data, "brokeremail"),
-        "namedinsured": safe_get(abc_data, "namedinsured"),
-        "nameandmailingaddress": safe_get(abc_data, "nameandmailingaddress"),
-
-        # -------- Dates --------------------------
-        "quotedate": quote_date,
-        "quoteexpirydate": expiry_date,
-
-        # -------- Stubbed ------------------------
-        "typeofcover": "Commercial Property",
-        "coveragebasis": "Fire & Allied Perils",
-
-        # -------- Coverage Summary (ABC) ---------
-        "effectivedate": safe_get(abc_data, "effectivedate"),
-        "expirationdate": safe_get(abc_data, "expirationdate"),
-        "limitofliabilit": safe_get(abc_data, "limitofliabilit"),
+            out_val = _format_value(value)
+            for r in token_rects:
+                stamp.white_and_write(fitz.Rect(r), out_val)
+
+            if label_rect is not None:
+                _write_next_to_label(stamp, fitz.Rect(label_rect), out_val)
+
+        stamp.commit()
+
+def fill_pdf_forms(
+    template_bytes: bytes,
+    field_maps,
+    template_index: list = None,
+    flatten: bool = False,
+    incremental: bool = False,
+    merge: bool = False,
+    output=None,
+):
+    """
+    Fill one template once per field map, indexing it only once. Returns a
+    list of PDFs (bytes), one per field map, in order.
+
+    With ``merge`` the quotes are instead written back to back into a single
+    PDF for print runs (bytes, or ``output`` when given). Template pages are
+    cloned into it with insert_pdf, so their fonts, images and content
+    streams are stored once however many quotes are merged.
+    """
+    if template_index is None:
+        template_index = build_template_index(template_bytes)
+    if merge:
+        return _fill_merged(template_bytes, field_maps, template_index, output)
+
+    # Opening from bytes is lazy in MuPDF, cheaper than cloning pages out of
+    # an open template, so separate outputs each get their own open
+    return [
+        fill_pdf_form(template_bytes, field_map, template_index, flatten, incremental)
+        for field_map in field_maps
+    ]
+
+def _fill_merged(template_bytes, field_maps, template_index, output=None):
+    with span("fill.open"):
+        template = fitz.open(stream=template_bytes, filetype="pdf")
+    merged = fitz.open()
+    try:
+        for field_map in field_maps:
+            if template.is_form_pdf:
+                # Field names must stay unique in one document; insert_pdf would
+                # rename repeats and their values would no longer match, so each
+                # copy is filled and flattened on its own first
+                with span("fill.open"):
+                    doc = fitz.open(stream=template_bytes, filetype="pdf")
+                try:
+                    _fill_document(doc, field_map, template_index, flatten=True)
+                    merged.insert_pdf(doc)
+                finally:
+                    doc.close()
+                continue
 
-        # -------- Premium Summary (GW) ----------
-        "totalpayablepremium": f"$ {safe_get(gw_data, 'totalpremiumamount')}",
-        "taxes": f"$ {safe_get(gw_data, 'taxesandsurchargesamount')}",
-    }
+            start = merged.page_count
+            # final=0 keeps the graft map, so later copies reuse the objects
+            # already copied from the template
+            merged.insert_pdf(template, final=0)
+            with span("fill.draw"):
+                _stamp_pages(merged.pages(start), field_map, template_index)
+
+        with span("fill.save"):
+            return _save_document(merged, None, output)
+    finally:
+        merged.close()
+        template.close()
@@ -1,144 +1,602 @@
+import hashlib
+import importlib
 import io
 import json
-import requests
-from urllib.parse import urlparse
-from datetime import datetime, timedelta
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from decimal import Decimal
 from config import AzureConf
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from pdf_fill import fill_pdf_form
+from blob_clients import ensure_container, get_container_client, get_fetch_blob_client
+from field_mapping import apply_field_spec, load_field_spec
+from fetch_policy import FetchPolicy, download_if_changed, fetch, fetch_paths, split_blob_url
+from result_cache import METADATA_KEY, invalidate_results, lookup_result, remember_result, result_key
+from tracing import collect_timings, record, span, url_attr
 from config import Defaults
 
-def _is_azure_blob_url(url: str) -> bool:
+try:
+    import ijson
+except ImportError:  # streaming extraction falls back to json.load
+    ijson = None
+
+# requests, the Azure SDK and PyMuPDF (pdf_fill) are imported where they are
+# first used, so a cold worker only pays for what its request touches.
+
+
+def _preload_pdf_engine() -> None:
+    # Imports PyMuPDF in the background while a cold worker waits on downloads
+    if "pdf_fill" not in sys.modules:
+        threading.Thread(target=importlib.import_module, args=("pdf_fill",), daemon=True).start()
+
+
+TEMPLATE_CACHE_DIR = os.environ.get(
+    "QUOTE_TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "quote-templates")
+)
+
+_TEMPLATE_CACHE = {}
+_TEMPLATE_CACHE_LOCK = threading.Lock()
+
+
+def _template_cache_paths(url: str) -> tuple:
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = os.path.join(TEMPLATE_CACHE_DIR, name)
+    return f"{base}.pdf", f"{base}.json"
+
+
+def _read_disk_template(url: str):
+    pdf_path, meta_path = _template_cache_paths(url)
     try:
-        host = urlparse(url).netloc.lower()
-        return ".blob.core.windows.net" in host
-    except Exception:
-        return False
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(pdf_path, "rb") as f:
+            template_bytes = f.read()
+    except (OSError, ValueError):
+        return None
+
+    from pdf_fill import TEMPLATE_INDEX_VERSION
 
+    # Indexes written by an older pdf_fill are rebuilt on the next download
+    if meta.get("index_version") != TEMPLATE_INDEX_VERSION:
+        return None
+    return meta["validators"], template_bytes, meta["index"]
 
-def _download_via_azure(url: str) -> bytes:
-    parsed = urlparse(url)
-    path = parsed.path.lstrip("/")
-    if "/" not in path:
-        raise ValueError(f"Invalid blob URL path: {path}")
 
-    container, blob_path = path.split("/", 1)
+def _write_disk_template(url: str, entry: tuple) -> None:
+    from pdf_fill import TEMPLATE_INDEX_VERSION
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    blob_client = bsc.get_container_client(container).get_blob_client(blob_path)
-    return blob_client.download_blob().readall()
+    validators, template_bytes, template_index = entry
+    pdf_path, meta_path = _template_cache_paths(url)
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        for path, data in (
+            (pdf_path, template_bytes),
+            (meta_path, json.dumps({
+                "validators": validators,
+                "index_version": TEMPLATE_INDEX_VERSION,
+                "index": template_index,
+            }).encode("utf-8")),
+        ):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+    except OSError:
+        # The disk tier is an optimisation only
+        pass
 
 
-def _download_bytes(url: str) -> bytes:
-    if _is_azure_blob_url(url) and AzureConf.CONNECTION_STRING:
-        try:
-            return _download_via_azure(url)
-        except Exception:
-            pass
+def _cached_template(url: str):
+    with _TEMPLATE_CACHE_LOCK:
+        cached = _TEMPLATE_CACHE.get(url)
+    return cached if cached is not None else _read_disk_template(url)
 
-    resp = requests.get(url, timeout=60)
-    resp.raise_for_status()
-    return resp.content
 
-def flatten_json(data, parent_key="", sep="."):
-    items = {}
-    if isinstance(data, dict):
-        for k, v in data.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            items.update(flatten_json(v, new_key, sep))
-    elif isinstance(data, list):
-        for i, v in enumerate(data):
-            new_key = f"{parent_key}{sep}{i}"
-            items.update(flatten_json(v, new_key, sep))
+def _store_template(url: str, cached, body, validators: dict) -> tuple:
+    if body is None:
+        entry = cached
+    else:
+        from pdf_fill import build_template_index
+
+        with span("index"):
+            entry = (validators, body, build_template_index(body))
+        if validators.get("etag") or validators.get("last_modified"):
+            _write_disk_template(url, entry)
+        if cached is not None:
+            # Template changed: quotes rendered from the old one are stale
+            invalidate_results(url)
+
+    with _TEMPLATE_CACHE_LOCK:
+        _TEMPLATE_CACHE[url] = entry
+    return entry
+
+
+def get_template(url: str) -> tuple:
+    """
+    Return (template_bytes, template_index) for a template URL. The parsed
+    template is kept in memory and under TEMPLATE_CACHE_DIR, and only
+    re-downloaded when its ETag / Last-Modified changes.
+    """
+    cached = _cached_template(url)
+    body, validators = download_if_changed(url, cached[0] if cached else {})
+    entry = _store_template(url, cached, body, validators)
+    return entry[1], entry[2]
+
+
+def _template_version(url: str, template_bytes: bytes) -> str:
+    with _TEMPLATE_CACHE_LOCK:
+        cached = _TEMPLATE_CACHE.get(url)
+    validators = cached[0] if cached is not None else {}
+    return (
+        validators.get("etag")
+        or validators.get("last_modified")
+        or hashlib.sha1(template_bytes).hexdigest()
+    )
+
+
+def clear_template_cache(disk: bool = False) -> None:
+    with _TEMPLATE_CACHE_LOCK:
+        _TEMPLATE_CACHE.clear()
+    if disk:
+        shutil.rmtree(TEMPLATE_CACHE_DIR, ignore_errors=True)
+
+def _json_children(key, value, sep):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield (f"{key}{sep}{k}" if key else k), v
     else:
-        items[parent_key] = data
+        for i, v in enumerate(value):
+            yield f"{key}{sep}{i}", v
+
+
+def flatten_json(data, parent_key="", sep=".", paths=None):
+    """
+    Flatten nested dicts/lists into a single {"a.b.0.c": value} dict without
+    recursion. When ``paths`` is given, only those flat keys are produced and
+    branches that cannot lead to one of them are never walked.
+    """
+    leaves = branches = None
+    if paths is not None:
+        leaves = set(paths)
+        branches = set()
+        for path in leaves:
+            pos = path.find(sep)
+            while pos != -1:
+                branches.add(path[:pos])
+                pos = path.find(sep, pos + 1)
+
+    if not isinstance(data, (dict, list)):
+        return {parent_key: data} if leaves is None or parent_key in leaves else {}
+
+    items = {}
+    stack = [_json_children(parent_key, data, sep)]
+    while stack:
+        for key, value in stack[-1]:
+            if isinstance(value, (dict, list)):
+                if branches is None or key in branches:
+                    stack.append(_json_children(key, value, sep))
+                    break
+            elif leaves is None or key in leaves:
+                items[key] = value
+        else:
+            stack.pop()
+    return items
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buf = memoryview(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def _open_azure_stream(url: str, timeout: float = 60) -> tuple:
+    container, blob_path = split_blob_url(url)
+    downloader = get_fetch_blob_client(container, blob_path).download_blob(timeout=max(1, int(timeout)))
+    return downloader.chunks(), lambda: None
+
+
+def _open_http_stream(url: str, timeout: float = 60) -> tuple:
+    import requests
+
+    resp = requests.get(url, timeout=timeout, stream=True)
+    try:
+        resp.raise_for_status()
+    except Exception:
+        resp.close()
+        raise
+    return resp.iter_content(64 * 1024), resp.close
+
+
+def _read_json_paths(opened: tuple, paths) -> tuple:
+    chunks, close = opened
+    try:
+        start = time.perf_counter()
+        items = stream_json_paths(_ChunkStream(chunks), paths)
+        return items, (time.perf_counter() - start) * 1000
+    finally:
+        close()
+
+
+def _iter_json_leaves(events, sep):
+    # frames: [flat key of the container, flat key of the current child, array index or None]
+    frames = [["", "", None]]
+    for _, event, value in events:
+        top = frames[-1]
+        if event == "map_key":
+            top[1] = f"{top[0]}{sep}{value}" if top[0] else value
+            continue
+        if event in ("end_map", "end_array"):
+            frames.pop()
+            continue
+
+        if top[2] is not None:
+            top[2] += 1
+            top[1] = f"{top[0]}{sep}{top[2]}"
+
+        if event == "start_map":
+            frames.append([top[1], top[1], None])
+        elif event == "start_array":
+            frames.append([top[1], top[1], -1])
+        elif isinstance(value, Decimal):
+            # Non-integers come as Decimal; json.loads gives float for these
+            yield top[1], float(value)
+        else:
+            yield top[1], value
+
+
+def stream_json_paths(stream, paths, sep=".") -> dict:
+    """
+    Pull only ``paths`` (flat keys, as produced by flatten_json) out of a
+    binary JSON stream, stopping as soon as all of them have been seen.
+    """
+    wanted = set(paths)
+    if ijson is None:
+        return flatten_json(json.load(stream), sep=sep, paths=wanted)
+
+    items = {}
+    for key, value in _iter_json_leaves(ijson.parse(stream), sep):
+        if key in wanted:
+            items[key] = value
+            if len(items) == len(wanted):
+                break
+    return items
+
+
+def extract_json_paths(url: str, paths, policy: FetchPolicy = None) -> dict:
+    # Opening and reading the body are one attempt, so a failure mid-stream
+    # is retried like a failed open. "parse" includes reading the body, which
+    # is streamed into the parser; "download" is the rest of the fetch.
+    attr = url_attr(url)
+    start = time.perf_counter()
+    try:
+        items, parse_ms = fetch(url, fetch_paths(
+            url,
+            lambda timeout: _read_json_paths(_open_azure_stream(url, timeout), paths),
+            lambda timeout: _read_json_paths(_open_http_stream(url, timeout), paths),
+        ), policy)
+    except BaseException:
+        record("download", (time.perf_counter() - start) * 1000, url=attr, error=True)
+        raise
+    record("download", (time.perf_counter() - start) * 1000 - parse_ms, url=attr)
+    record("parse", parse_ms, url=attr)
     return items
 
 
-def safe_get(flat_json: dict, key: str) -> str:
-    val = flat_json.get(key)
-    return "" if val in (None, "null") else str(val)
+FIELD_SPEC = load_field_spec()
+
+# Flat keys build_pdf_field_map reads from each document
+ABC_FIELD_PATHS = FIELD_SPEC["paths"].get("abc", ())
+GW_FIELD_PATHS = FIELD_SPEC["paths"].get("gw", ())
+
 
 def build_pdf_field_map(abc_data: dict, gw_data: dict) -> dict:
-    today = datetime.today()
-    quote_date = today.strftime("%d/%m/%y")
-    expiry_date = (today + timedelta(days=30)).strftime("%d/%m/%y")
-
-    return {
-        # -------- Broker / Insured (ABC) --------
-        "SubDoc.BrokerName": safe_get(abc_data, "brokername"),
-        "oragnizationname": safe_get(abc_data, "oragnizationname"),
-        "brokeremail": safe_get(abc_data, "brokeremail"),
-        "namedinsured": safe_get(abc_data, "namedinsured"),
-        "nameandmailingaddress": safe_get(abc_data, "nameandmailingaddress"),
-
-        # -------- Dates --------------------------
-        "quotedate": quote_date,
-        "quoteexpirydate": expiry_date,
-
-        # -------- Stubbed ------------------------
-        ": Commercial Property ": "Commercial Property",
-        "coveragebasis": "Fire & Allied Perils",
-
-        # -------- Coverage Summary (ABC) ---------
-        "effectivedate": safe_get(abc_data, "effectivedate"),
-        "expirationdate": safe_get(abc_data, "expirationdate"),
-        "limitofliabilit": safe_get(abc_data, "limitofliabilit"),
-
-        # -------- Premium Summary (GW) ----------
-        "totalpayablepremium": f"$ {safe_get(gw_data, 'totalpremiumamount')}",
-        "taxes": f"$ {safe_get(gw_data, 'taxesandsurchargesamount')}",
-    }
-
-
-def _upload_pdf(filename: str, pdf_bytes: bytes) -> str:
+    with span("field_map"):
+        return apply_field_spec(FIELD_SPEC, {"abc": abc_data, "gw": gw_data})
+
+
+OUTPUT_CONTAINER = "quotes-output"
+
+
+def provision_output_container() -> None:
+    """Create the output container if needed; run once at deployment/startup."""
+    ensure_container(OUTPUT_CONTAINER, create=True)
+
+
+# PDFs above one block are uploaded as parallel staged blocks
+UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+UPLOAD_MAX_CONCURRENCY = 4
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable read-only file object over a memoryview, without copying it."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def _upload_blocks(blob_client, view, content_settings, metadata=None) -> None:
+    from azure.core import MatchConditions
+    from azure.storage.blob import BlobBlock
+
+    starts = range(0, len(view), UPLOAD_BLOCK_SIZE)
+
+    def stage(item):
+        i, start = item
+        block = view[start:start + UPLOAD_BLOCK_SIZE]
+        block_id = f"{i:08d}"
+        blob_client.stage_block(block_id, _ViewReader(block), length=len(block))
+        return BlobBlock(block_id=block_id)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_MAX_CONCURRENCY) as pool:
+        block_list = list(pool.map(stage, enumerate(starts)))
+    blob_client.commit_block_list(
+        block_list,
+        content_settings=content_settings,
+        metadata=metadata,
+        match_condition=MatchConditions.IfMissing,
+    )
+
+
+def _upload_pdf(filename: str, pdf, metadata: dict = None) -> str:
+    """
+    Upload a generated PDF given as bytes, a memoryview or the BytesIO that
+    fill_pdf_form wrote into. The data is read through memoryviews, never
+    copied.
+
+    Blobs are only ever created (If-None-Match: *). Filenames identify the
+    quote content, so an existing blob is the same quote stored by a retry
+    or a concurrent worker, and its URL is returned; when ``metadata``
+    carries a quote key, the existing blob's key must match it.
+    """
     if not (AzureConf.CONNECTION_STRING and AzureConf.ACCOUNT_URL):
         raise RuntimeError("Missing Azure storage configuration")
 
-    container_name = "quotes-output"
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.blob import ContentSettings
 
-    bsc = BlobServiceClient.from_connection_string(AzureConf.CONNECTION_STRING)
-    container_client = bsc.get_container_client(container_name)
+    container_name = OUTPUT_CONTAINER
 
-    try:
-        container_client.create_container()
-    except Exception:
-        pass
+    ensure_container(container_name)
+    container_client = get_container_client(container_name)
+
+    view = pdf.getbuffer() if isinstance(pdf, io.BytesIO) else memoryview(pdf)
+    content_settings = ContentSettings(content_type="application/pdf")
 
     blob_client = container_client.get_blob_client(filename)
-    blob_client.upload_blob(
-        io.BytesIO(pdf_bytes),
-        overwrite=True,
-        content_settings=ContentSettings(content_type="application/pdf"),
-    )
+    try:
+        if len(view) > UPLOAD_BLOCK_SIZE:
+            _upload_blocks(blob_client, view, content_settings, metadata)
+        else:
+            blob_client.upload_blob(
+                _ViewReader(view),
+                length=len(view),
+                overwrite=False,
+                content_settings=content_settings,
+                metadata=metadata,
+            )
+    except ResourceExistsError:
+        _check_same_quote(filename, metadata, blob_client.get_blob_properties().metadata)
 
     return f"{AzureConf.ACCOUNT_URL}/{container_name}/{filename}"
 
-def generate_quote():
-    try:
-        # Download JSONs
-        data_extraction_bytes = _download_bytes(Defaults.DATA_EXTRACTION_URL)
-        gw_bytes = _download_bytes(Defaults.GW_URL)
 
-        abc_json = flatten_json(json.loads(data_extraction_bytes.decode("utf-8")))
-        gw_json = flatten_json(json.loads(gw_bytes.decode("utf-8")))
+def _check_same_quote(filename: str, metadata: dict, stored_metadata: dict) -> None:
+    key = (metadata or {}).get(METADATA_KEY)
+    if key is not None and (stored_metadata or {}).get(METADATA_KEY) != key:
+        raise RuntimeError(f"Blob '{filename}' already exists and holds a different quote")
+
+def _field_map_from_bytes(data_extraction_bytes: bytes, gw_bytes: bytes) -> dict:
+    # Same extractor as the streamed sync path, so both parse alike
+    with span("parse"):
+        abc_json = stream_json_paths(io.BytesIO(data_extraction_bytes), ABC_FIELD_PATHS)
+        gw_json = stream_json_paths(io.BytesIO(gw_bytes), GW_FIELD_PATHS)
+
+    return build_pdf_field_map(abc_json, gw_json)
+
+
+def _load_field_map(data_extraction_url: str, gw_url: str) -> dict:
+    abc_json = extract_json_paths(data_extraction_url, ABC_FIELD_PATHS)
+    gw_json = extract_json_paths(gw_url, GW_FIELD_PATHS)
+    return build_pdf_field_map(abc_json, gw_json)
+
+
+_FILENAME_UNSAFE_RE = re.compile(r"[^A-Za-z0-9]+")
+
+
+def _quote_filename(field_map: dict, quote_key: str) -> str:
+    """
+    ddmmyy_<insured>_<key>_Quote.pdf, where key is the quote's result_key,
+    so the same quote always gets the same name and different quotes (or
+    template versions) never collide.
+    """
+    insured = _FILENAME_UNSAFE_RE.sub("-", field_map.get("namedinsured", "")).strip("-")[:40]
 
-        # Download PDF template
-        template_bytes = _download_bytes(Defaults.PDF_TEMPLATE_URL)
+    parts = [datetime.today().strftime("%d%m%y"), insured, quote_key[:16], "Quote"]
+    return "_".join(p for p in parts if p) + ".pdf"
 
-        # Build PDF field map
-        pdf_field_map = build_pdf_field_map(abc_json, gw_json)
+
+def _prepare_quote(data_extraction_url: str, gw_url: str, template_url: str, template: tuple) -> tuple:
+    """
+    Returns (field_map, quote_key, filename, existing_url); existing_url is
+    set when this exact quote has already been generated and stored.
+    """
+    pdf_field_map = _load_field_map(data_extraction_url, gw_url)
+    quote_key = result_key(_template_version(template_url, template[0]), pdf_field_map)
+    filename = _quote_filename(pdf_field_map, quote_key)
+    with span("result_lookup"):
+        existing_url = lookup_result(quote_key, OUTPUT_CONTAINER, filename)
+    return pdf_field_map, quote_key, filename, existing_url
+
+
+def _upload_quote(filename: str, pdf, quote_key: str, template_url: str) -> str:
+    with span("upload"):
+        blob_url = _upload_pdf(filename, pdf, metadata={METADATA_KEY: quote_key})
+    remember_result(quote_key, template_url, blob_url)
+    return blob_url
+
+
+def generate_quote(data_extraction_url=None, gw_url=None, pdf_template_url=None, timings=False):
+    """
+    Generate, upload and return {"error": False, "url": ...} for one quote.
+    Every stage is traced (see tracing.add_sink); with ``timings`` the
+    result also carries {"timings": {stage: ms}} for this quote.
+    """
+    with collect_timings() as stage_ms:
+        with span("total"):
+            result = _generate_quote(data_extraction_url, gw_url, pdf_template_url)
+    if timings:
+        result["timings"] = {stage: round(ms, 2) for stage, ms in stage_ms.items()}
+    return result
+
+
+def _generate_quote(data_extraction_url, gw_url, pdf_template_url):
+    try:
+        template_url = pdf_template_url or Defaults.PDF_TEMPLATE_URL
+        _preload_pdf_engine()
+
+        # PDF template (cached while unchanged)
+        with span("template"):
+            template_bytes, template_index = get_template(template_url)
+
+        # Download JSONs, build PDF field map and check for an identical earlier quote
+        pdf_field_map, quote_key, filename, existing_url = _prepare_quote(
+            data_extraction_url or Defaults.DATA_EXTRACTION_URL,
+            gw_url or Defaults.GW_URL,
+            template_url,
+            (template_bytes, template_index),
+        )
+        if existing_url:
+            return {"error": False, "url": existing_url}
 
         # Fill PDF
-        filled_pdf = fill_pdf_form(template_bytes, pdf_field_map)
+        from pdf_fill import fill_pdf_form
 
-        # Filename
-        filename = f"{datetime.today().strftime('%d%m%y')}_Quote.pdf"
+        with span("fill"):
+            filled_pdf = fill_pdf_form(template_bytes, pdf_field_map, template_index, output=io.BytesIO())
 
         # Upload
-        blob_url = _upload_pdf(filename, filled_pdf)
+        blob_url = _upload_quote(filename, filled_pdf, quote_key, template_url)
 
         return {"error": False, "url": blob_url}
 
     except Exception as e:
         return {"error": True, "error_message": str(e)}
+
+
+def _prepare_batch_job(data_extraction_url: str, gw_url: str, template_url: str, template_future) -> tuple:
+    return _prepare_quote(data_extraction_url, gw_url, template_url, template_future.result())
+
+
+def generate_quotes(batch, io_workers: int = 16, cpu_workers: int = None, engine=None) -> list:
+    """
+    Generate many quotes as a pipeline. Each job is a
+    (data_extraction_url, gw_url, pdf_template_url) tuple; as in
+    generate_quote(), a None URL means its Defaults value. Downloads and
+    uploads run on a bounded thread pool, PDF fills on a FillEngine process
+    pool that keeps each template warm in its workers.
+
+    Pass a long-lived ``engine`` to keep its worker processes and templates
+    across batches; the caller shuts it down. Without one, a FillEngine with
+    ``cpu_workers`` processes is started and shut down for this batch.
+    Returns one result dict per job, in input order.
+    """
+    jobs = [
+        (abc_url or Defaults.DATA_EXTRACTION_URL, gw_url or Defaults.GW_URL, template_url or Defaults.PDF_TEMPLATE_URL)
+        for abc_url, gw_url, template_url in batch
+    ]
+    results = [None] * len(jobs)
+    prepared = [None] * len(jobs)
+    if not jobs:
+        return results
+
+    if engine is None:
+        from fill_engine import FillEngine
+
+        engine_context = FillEngine(max_workers=cpu_workers)
+    else:
+        engine_context = nullcontext(engine)
+    registered = set()
+
+    with ThreadPoolExecutor(max_workers=io_workers) as io_pool, engine_context as engine:
+        # Templates are usually shared across a batch, fetch each one once.
+        # Submitted first, so jobs waiting on them never starve the pool.
+        templates = {url: io_pool.submit(get_template, url) for url in {job[2] for job in jobs}}
+
+        pending = {
+            io_pool.submit(_prepare_batch_job, abc_url, gw_url, template_url, templates[template_url]): ("load", i)
+            for i, (abc_url, gw_url, template_url) in enumerate(jobs)
+        }
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, i = pending.pop(fut)
+                try:
+                    value = fut.result()
+                    template_url = jobs[i][2]
+                    if stage == "load":
+                        field_map, quote_key, filename, existing_url = value
+                        if existing_url:
+                            results[i] = {"error": False, "url": existing_url}
+                            continue
+                        prepared[i] = (quote_key, filename, time.perf_counter())
+                        # Once per batch: a long-lived engine may hold an older version
+                        if template_url not in registered:
+                            engine.register_template(template_url, *templates[template_url].result())
+                            registered.add(template_url)
+                        pending[engine.submit(template_url, field_map)] = ("fill", i)
+                    elif stage == "fill":
+                        quote_key, filename, submitted = prepared[i]
+                        # Fills run in engine processes; this includes time queued there
+                        record("fill.engine", (time.perf_counter() - submitted) * 1000)
+                        upload = io_pool.submit(_upload_quote, filename, value, quote_key, template_url)
+                        pending[upload] = ("upload", i)
+                    else:
+                        results[i] = {"error": False, "url": value}
+                except Exception as e:
+                    results[i] = {"error": True, "error_message": str(e)}
+
+    return results
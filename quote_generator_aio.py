@@ -0,0 +1,230 @@
+import asyncio
+import threading
+
+import aiohttp
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+
+from blob_clients import DEFAULT_POOL_SIZE
+from config import AzureConf, Defaults
+from fetch_policy import FetchPolicy, async_fetch, fetch_paths, split_blob_url
+from pdf_fill import fill_pdf_form
+from quote_generator import (
+    OUTPUT_CONTAINER,
+    _cached_template,
+    _check_same_quote,
+    _field_map_from_bytes,
+    _quote_filename,
+    _store_template,
+    _template_version,
+)
+from result_cache import METADATA_KEY, _blob_result_url, lookup_result, remember_result, result_key
+from tracing import span, url_attr
+
+# {event loop: {"http": ClientSession, "blob": BlobServiceClient, "fetch_blob": ...}};
+# clients only work on the loop that created them
+_loop_clients = {}
+_loop_clients_lock = threading.Lock()
+_closing = set()
+_verified_containers = set()
+
+
+async def _close_clients(clients: dict) -> None:
+    for name in ("blob", "fetch_blob"):
+        if name in clients:
+            await clients[name].close()
+    if "http" in clients:
+        await clients["http"].close()
+
+
+def _clients() -> dict:
+    loop = asyncio.get_running_loop()
+    with _loop_clients_lock:
+        stale = [_loop_clients.pop(l) for l in list(_loop_clients) if l.is_closed()]
+        clients = _loop_clients.setdefault(loop, {})
+    # A loop that ended without aclose() left its clients open; with that loop
+    # gone there is nothing to wait for, so they close on this one
+    for old in stale:
+        task = loop.create_task(_close_clients(old))
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+    return clients
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    clients = _clients()
+    session = clients.get("http")
+    if session is None or session.closed:
+        session = clients["http"] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=DEFAULT_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+        # The blob clients' transport rides on the session they were built with
+        clients.pop("blob", None)
+        clients.pop("fetch_blob", None)
+    return session
+
+
+def _get_service_client(name: str = "blob", **kwargs) -> BlobServiceClient:
+    clients = _clients()
+    if name not in clients:
+        if not AzureConf.CONNECTION_STRING:
+            raise RuntimeError("Missing Azure storage configuration")
+        transport = AioHttpTransport(session=_get_http_session(), session_owner=False)
+        clients[name] = BlobServiceClient.from_connection_string(
+            AzureConf.CONNECTION_STRING, transport=transport, **kwargs
+        )
+    return clients[name]
+
+
+async def aclose() -> None:
+    """Close this event loop's clients; call before the loop ends, e.g. at the end of asyncio.run()."""
+    with _loop_clients_lock:
+        clients = _loop_clients.pop(asyncio.get_running_loop(), {})
+    await _close_clients(clients)
+
+
+def _async_fetch_blob_client(url: str):
+    # async_fetch owns retries and timeouts for these reads, as fetch() does for sync ones
+    container, blob_path = split_blob_url(url)
+    return _get_service_client("fetch_blob", retry_total=0).get_blob_client(container, blob_path)
+
+
+async def _download_via_azure(url: str, timeout: float) -> bytes:
+    downloader = await _async_fetch_blob_client(url).download_blob(timeout=max(1, int(timeout)))
+    return await downloader.readall()
+
+
+async def _download_via_http(url: str, timeout: float) -> bytes:
+    async with _get_http_session().get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def async_download_bytes(url: str, policy: FetchPolicy = None) -> bytes:
+    with span("download", url=url_attr(url)):
+        return await async_fetch(url, fetch_paths(
+            url,
+            lambda timeout: _download_via_azure(url, timeout),
+            lambda timeout: _download_via_http(url, timeout),
+        ), policy)
+
+
+async def _download_if_changed_via_azure(url: str, validators: dict, timeout: float) -> tuple:
+    blob_client = _async_fetch_blob_client(url)
+    server_timeout = max(1, int(timeout))
+    etag = (await blob_client.get_blob_properties(timeout=server_timeout)).etag
+    if etag and etag == validators.get("etag"):
+        return None, validators
+    downloader = await blob_client.download_blob(timeout=server_timeout)
+    return await downloader.readall(), {"etag": downloader.properties.etag}
+
+
+async def _download_if_changed_via_http(url: str, validators: dict, timeout: float) -> tuple:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    async with _get_http_session().get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+        if resp.status == 304:
+            return None, validators
+        resp.raise_for_status()
+        body = await resp.read()
+        return body, {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
+
+async def _async_download_if_changed(url: str, validators: dict, policy: FetchPolicy = None) -> tuple:
+    with span("download", url=url_attr(url)):
+        return await async_fetch(url, fetch_paths(
+            url,
+            lambda timeout: _download_if_changed_via_azure(url, validators, timeout),
+            lambda timeout: _download_if_changed_via_http(url, validators, timeout),
+        ), policy)
+
+
+async def async_get_template(url: str) -> tuple:
+    cached = _cached_template(url)
+    body, validators = await _async_download_if_changed(url, cached[0] if cached else {})
+    if body is None:
+        entry = _store_template(url, cached, None, validators)
+    else:
+        # Indexing the template is CPU work, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, _store_template, url, cached, body, validators)
+    return entry[1], entry[2]
+
+
+async def async_upload_pdf(filename: str, pdf_bytes: bytes, metadata: dict = None) -> str:
+    if not (AzureConf.CONNECTION_STRING and AzureConf.ACCOUNT_URL):
+        raise RuntimeError("Missing Azure storage configuration")
+
+    container_client = _get_service_client().get_container_client(OUTPUT_CONTAINER)
+
+    if OUTPUT_CONTAINER not in _verified_containers:
+        if not await container_client.exists():
+            raise RuntimeError(f"Blob container '{OUTPUT_CONTAINER}' does not exist")
+        _verified_containers.add(OUTPUT_CONTAINER)
+
+    try:
+        await container_client.upload_blob(
+            filename,
+            pdf_bytes,
+            overwrite=False,
+            content_settings=ContentSettings(content_type="application/pdf"),
+            metadata=metadata,
+        )
+    except ResourceExistsError:
+        # Same filename means same quote content, see _upload_pdf
+        props = await container_client.get_blob_client(filename).get_blob_properties()
+        _check_same_quote(filename, metadata, props.metadata)
+
+    return f"{AzureConf.ACCOUNT_URL}/{OUTPUT_CONTAINER}/{filename}"
+
+
+async def _async_lookup_result(key: str, container: str, blob_name: str):
+    # lookup_result with its blob-metadata tier read through the async client
+    existing_url = lookup_result(key, container, blob_name, check_blob=False)
+    if existing_url or not (AzureConf.CONNECTION_STRING and AzureConf.ACCOUNT_URL):
+        return existing_url
+
+    try:
+        props = await _get_service_client().get_blob_client(container, blob_name).get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    return _blob_result_url(key, container, blob_name, props.metadata)
+
+
+async def async_generate_quote(data_extraction_url=None, gw_url=None, pdf_template_url=None):
+    try:
+        template_url = pdf_template_url or Defaults.PDF_TEMPLATE_URL
+
+        # Both JSONs and the template are fetched concurrently
+        data_extraction_bytes, gw_bytes, (template_bytes, template_index) = await asyncio.gather(
+            async_download_bytes(data_extraction_url or Defaults.DATA_EXTRACTION_URL),
+            async_download_bytes(gw_url or Defaults.GW_URL),
+            async_get_template(template_url),
+        )
+
+        pdf_field_map = _field_map_from_bytes(data_extraction_bytes, gw_bytes)
+        quote_key = result_key(_template_version(template_url, template_bytes), pdf_field_map)
+        filename = _quote_filename(pdf_field_map, quote_key)
+
+        with span("result_lookup"):
+            existing_url = await _async_lookup_result(quote_key, OUTPUT_CONTAINER, filename)
+        if existing_url:
+            return {"error": False, "url": existing_url}
+
+        loop = asyncio.get_running_loop()
+        filled_pdf = await loop.run_in_executor(None, fill_pdf_form, template_bytes, pdf_field_map, template_index)
+
+        blob_url = await async_upload_pdf(filename, filled_pdf, metadata={METADATA_KEY: quote_key})
+        remember_result(quote_key, template_url, blob_url)
+
+        return {"error": False, "url": blob_url}
+
+    except Exception as e:
+        return {"error": True, "error_message": str(e)}
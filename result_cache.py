@@ -0,0 +1,79 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from blob_clients import get_blob_client
+from config import AzureConf
+
+MAX_ENTRIES = 1024
+METADATA_KEY = "quote_key"
+
+# key -> (template_url, blob_url), most recently used last
+_results = OrderedDict()
+_lock = threading.Lock()
+
+
+def result_key(template_version: str, field_map: dict) -> str:
+    """
+    Content address of a quote: the template version plus the full field
+    map, which already carries the quote/expiry dates.
+    """
+    payload = json.dumps([template_version, field_map], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _lookup_blob(key: str, container: str, blob_name: str):
+    if not (AzureConf.CONNECTION_STRING and AzureConf.ACCOUNT_URL):
+        return None
+
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        props = get_blob_client(container, blob_name).get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+    return _blob_result_url(key, container, blob_name, props.metadata)
+
+
+def _blob_result_url(key: str, container: str, blob_name: str, metadata: dict):
+    if (metadata or {}).get(METADATA_KEY) != key:
+        return None
+    return f"{AzureConf.ACCOUNT_URL}/{container}/{blob_name}"
+
+
+def lookup_result(key: str, container: str, blob_name: str, check_blob: bool = True):
+    """
+    Return the URL of an already generated quote for ``key``, from the
+    in-process LRU first and then from the stored blob's metadata.
+    """
+    with _lock:
+        hit = _results.get(key)
+        if hit is not None:
+            _results.move_to_end(key)
+            return hit[1]
+
+    if not check_blob:
+        return None
+    return _lookup_blob(key, container, blob_name)
+
+
+def remember_result(key: str, template_url: str, blob_url: str) -> None:
+    with _lock:
+        _results[key] = (template_url, blob_url)
+        _results.move_to_end(key)
+        while len(_results) > MAX_ENTRIES:
+            _results.popitem(last=False)
+
+
+def invalidate_results(template_url: str = None) -> None:
+    """
+    Drop cached results, for one template or all of them. Blob-backed
+    entries need no invalidation: their key includes the template version.
+    """
+    with _lock:
+        if template_url is None:
+            _results.clear()
+            return
+        for key in [k for k, (url, _) in _results.items() if url == template_url]:
+            del _results[key]
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# {stage: total ms} for the quote being generated in this context, if collected
+_current = ContextVar("quote_stage_timings", default=None)
+_sinks = ()
+_lock = threading.Lock()
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def url_attr(url: str) -> str:
+    """
+    scheme://host/path of ``url``, for span attributes and logs: query
+    strings (SAS signatures) and credentials never reach a sink.
+    """
+    parts = urlsplit(url or "")
+    host = parts.hostname or ""
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    return urlunsplit((parts.scheme, host, parts.path, "", ""))
+
+
+def add_sink(sink) -> None:
+    """
+    Register ``sink(stage, duration_ms, attrs)``, called for every finished
+    span in this process. Sinks run inline, so they should be cheap.
+    """
+    global _sinks
+    with _lock:
+        _sinks = _sinks + (sink,)
+
+
+def remove_sink(sink) -> None:
+    global _sinks
+    with _lock:
+        _sinks = tuple(s for s in _sinks if s is not sink)
+
+
+def record(stage: str, duration_ms: float, **attrs) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + duration_ms
+    for sink in _sinks:
+        try:
+            sink(stage, duration_ms, attrs)
+        except Exception:
+            logger.exception("trace sink %r failed", sink)
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        attrs["error"] = True
+        raise
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000, **attrs)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect {stage: total ms} for the spans finished inside this block (on
+    this thread/task). A stage seen twice, e.g. "download", is summed.
+    """
+    timings = {}
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+class LoggingSink:
+    def __init__(self, level: int = logging.INFO, log: logging.Logger = None):
+        self.level = level
+        self.log = log or logger
+
+    def __call__(self, stage, duration_ms, attrs):
+        self.log.log(self.level, "%s %.1f ms %s", stage, duration_ms, attrs or "")
+
+
+class HistogramSink:
+    """In-memory latency samples per stage, for p50/p99 without a metrics backend."""
+
+    def __init__(self, max_samples: int = 4096):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, duration_ms, attrs):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.max_samples)).append(duration_ms)
+
+    def summary(self, percentiles=(0.50, 0.99)) -> dict:
+        """{stage: {"count": n, "p50": ms, "p99": ms, ...}}"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+        out = {}
+        for stage, values in samples.items():
+            out[stage] = {"count": len(values)}
+            for q in percentiles:
+                out[stage][f"p{q * 100:g}"] = percentile(values, q)
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+class OpenTelemetrySink:
+    """
+    Export each span to OpenTelemetry. Uses the global tracer provider unless
+    a ``tracer`` is given; needs the opentelemetry-api package.
+    """
+
+    def __init__(self, tracer=None, prefix: str = "quote."):
+        if tracer is None:
+            from opentelemetry import trace
+
+            tracer = trace.get_tracer("quote")
+        self.tracer = tracer
+        self.prefix = prefix
+
+    def __call__(self, stage, duration_ms, attrs):
+        end_ns = time.time_ns()
+        attributes = {k: v for k, v in attrs.items() if isinstance(v, (str, bool, int, float))}
+        otel_span = self.tracer.start_span(
+            self.prefix + stage,
+            start_time=end_ns - int(duration_ms * 1_000_000),
+            attributes=attributes,
+        )
+        otel_span.end(end_time=end_ns)